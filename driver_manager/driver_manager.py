@@ -1,64 +1,175 @@
+import os
 import time
+import logging
 import multiprocessing
+import multiprocessing.connection
 import threading
-import copy
+import concurrent.futures
+import collections
+import select
+import socket
 import enum 
 
 from driver_manager.drivers import *
+from driver_manager.drivers.driver import SharedValues
 
 VERSION = "2.0.5"
 
-def RunDriverManager(pipe:multiprocessing.Pipe, use_processes:bool=False, status_file_path:str='') -> None:
-    _object = DriverManager(use_processes, status_file_path)
+LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+}
+
+def RunDriverManager(pipe:multiprocessing.Pipe, use_processes:bool=False, status_file_path:str='', log_level:int=logging.INFO) -> None:
+    _object = DriverManager(use_processes, status_file_path, log_level)
     _object.run_forever(pipe)
     
-def RunDriver(driver_object:any, name:str, pipe:multiprocessing.Pipe, params:dict) -> None:
+def RunDriver(driver_object:any, name:str, pipe:multiprocessing.Pipe, params:dict, shared_values_name:str=None, shared_values_lock:multiprocessing.Lock=None) -> None:
     _object = driver_object(name, pipe, params)
-    _object.run()
+    if shared_values_name is not None:
+        _object.shared_values = SharedValues(name=shared_values_name, lock=shared_values_lock)
+    try:
+        _object.run()
+    finally:
+        pipe.close()
+
+def _hashable(value:any) -> any:
+    """ Returns a hashable representation of a parameter value, converting containers recursively. """
+    if isinstance(value, dict):
+        return frozenset((key, _hashable(item)) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    elif isinstance(value, set):
+        return frozenset(_hashable(item) for item in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def _driver_key(driver_data:dict) -> tuple:
+    """ Returns the key used to index drivers by class and setup parameters.
+
+    :param driver_data: Driver setup data, including parameters. (See documentation)
+    """
+    setup_data = driver_data.get("SETUP", {})
+    parameters = setup_data.get("parameters", None) or {}
+    return (driver_data.get("DRIVER", "None"), _hashable(parameters))
+
+class _ThreadPipe():
+    """ Pipe-like connection between two threads of the same process. Objects are passed by reference 
+    through a deque, so they are not pickled as with multiprocessing.Pipe().
+
+    A socket pair holds one signal byte while there are pending objects, which allows 
+    to use the connection in multiprocessing.connection.wait().
+
+    :param inbox: Channel to receive from, or None if this end only sends
+
+    :param outbox: Channel to send to, or None if this end only receives
+
+    :param tag: (optional) Object sent before each message, (tag, *message), so several ends can send to a shared channel
+    """
+
+    def __init__(self, inbox:tuple, outbox:tuple, tag:any=None):
+        self._inbox, self._in_lock, self._in_sock, _ = inbox or (None, None, None, None)
+        self._outbox, self._out_lock, _, self._out_sock = outbox or (None, None, None, None)
+        self.tag = tag
+
+    @staticmethod
+    def _channel() -> tuple:
+        rsock, wsock = socket.socketpair()
+        return (collections.deque(), threading.Lock(), rsock, wsock)
+
+    @classmethod
+    def pair(cls) -> tuple:
+        """ Returns both ends of a new connection, as multiprocessing.Pipe() does. """
+        a, b = cls._channel(), cls._channel()
+        return cls(a, b), cls(b, a)
+
+    def fileno(self) -> int:
+        return self._in_sock.fileno()
+
+    def send(self, obj:any):
+        with self._out_lock:
+            if not self._outbox:
+                self._out_sock.send(b'\x00')
+            self._outbox.append(obj if self.tag is None else (self.tag, *obj))
+
+    def recv(self) -> any:
+        while not self._inbox:
+            select.select([self._in_sock], [], [])
+        with self._in_lock:
+            obj = self._inbox.popleft()
+            if not self._inbox:
+                self._in_sock.recv(1)
+        return obj
+
+    def poll(self, timeout:float=0.0) -> bool:
+        if not self._inbox and timeout != 0:
+            select.select([self._in_sock], [], [], timeout)
+        return bool(self._inbox)
+
+    def close(self):
+        # Shared channels, the ones sent to with a tag, are closed by their owner
+        for sock in (self._in_sock, self._out_sock if self.tag is None else None):
+            if sock is not None:
+                sock.close()
 
 class DriverMgrCommands(str, enum.Enum):
     SETUP_DRIVERS = 'SETUP_DRIVERS'
     CLEAN = 'CLEAN'
     UPDATES = 'UPDATES'
+    UPDATES_BY_ID = 'UPDATES_BY_ID'
+    HANDLE_IDS = 'HANDLE_IDS'
     STATUS = 'STATUS'
     INFO = 'INFO'
     VAR_INFO = 'VAR_INFO'
     STATS = 'STATS'
 
 class DriverStructure():
+    __slots__ = ('class_name', 'name', 'handlers', 'parameters', '_parameter_items', '_parameter_keys', 'variables', 'status', 'info', 
+                 'info_log', 'latency', 'pipe', 'process', 'drain_thread', 'shared_values', 'updates', 'shared_updates')
     
-    def __init__(self, class_name:str, driver_name:str, handle:str, parameters:dict, pipe:multiprocessing.Pipe, driver_process:any):
+    def __init__(self, class_name:str, driver_name:str, handle:str, parameters:dict, pipe:multiprocessing.Pipe, driver_process:any, shared_values:SharedValues=None):
         self.class_name = class_name
         self.name = driver_name
         self.handlers = [handle]
         self.parameters = parameters
+        self._parameter_items = _hashable(parameters or {})
+        self._parameter_keys = frozenset(parameters or {})
         self.variables = {}
         self.status = ""
         self.info = ""
-        self.info_log = []
+        self.info_log = collections.deque(maxlen=5)
         self.latency = ""
         self.pipe = pipe
         self.process = driver_process
+        self.drain_thread = None
+        self.shared_values = shared_values
         self.updates = {}
+        self.shared_updates = False
         
     def add_handle(self, handle:str):
         self.handlers.append(handle)
     
-    def is_compatible(self, driver_data: dict) -> bool:
+    def is_compatible(self, driver_data: dict, driver_key:tuple=None) -> bool:
         """ Tells if the driver is compatible with the given class and setup parameters. 
+        Parameters given in both must have the same value, the rest are ignored.
 
         :param driver_data: Driver setup data, including parameters. (See documentation)
 
+        :param driver_key: (optional) Key of the driver data, if already computed. See _driver_key()
+
         :returns: True if compatible or False if not
         """
-        driver_class_name = driver_data.get("DRIVER", "None")
-        setup_data = driver_data.get("SETUP", {})
-        parameters = setup_data.get("parameters", None)
+        (driver_class_name, parameter_items) = driver_key or _driver_key(driver_data)
         if self.class_name == driver_class_name:
-            for key, value in parameters.items():
-                if key in self.parameters:
-                    if self.parameters[key] != value:
-                        return False
+            # Only the parameters which are not exactly the same need to be checked
+            for key, _ in parameter_items - self._parameter_items:
+                if key in self._parameter_keys:
+                    return False
             return True
         return False
 
@@ -66,7 +177,7 @@ class DriverStructure():
         """ Adds variables to the given driver. 
         :param variables: Dictionary with all variables to be added. (See documentation)
         
-        :returns: Dictionary with {<var_handle>: (<var_id>, <driver_name>)}
+        :returns: Dictionary with {<var_handle>: (<var_id>, <driver_struct>, <var_struct>)}
         """          
         res = {}
         var_setup_data = {}
@@ -76,18 +187,25 @@ class DriverStructure():
                 if var_id not in self.variables:
                     var_structure = VariableStructure(var_handle, var_data)
                     self.variables[var_id] = var_structure
-                    var_setup_data[var_id] = var_data
+                    if self.shared_values is not None:
+                        var_structure.shm_index = self.shared_values.addVariable(var_id, var_data)
+                    # Drivers get their own copy, since in threads it is not pickled
+                    if var_structure.shm_index is not None:
+                        var_setup_data[var_id] = dict(var_data, shm_index=var_structure.shm_index)
+                    else:
+                        var_setup_data[var_id] = dict(var_data)
                 else:
                     # TODO: Consider a variable that already has ben setup but now is the other type (READ/WRITE) so it should be changed to BOTH
                     # An option can be to store the variable operation as well in the self.variables dict ([handles], operation)
                     var_structure = self.variables[var_id] 
                     var_structure.add_handle(var_handle)   
-                res[var_handle] = (var_id, self.name)
+                res[var_handle] = (var_id, self, var_structure)
         if self.pipe and var_setup_data:
             self.pipe.send((DriverActions.ADD_VARIABLES, var_setup_data))
         return res
     
 class VariableStructure():
+    __slots__ = ('handlers', 'parameters', 'value', 'info', 'write_count', 'read_count', 'shm_index')
     
     def __init__(self, handle:str, parameters:dict):
         self.handlers = [handle]
@@ -96,28 +214,38 @@ class VariableStructure():
         self.info = ''
         self.write_count = 0
         self.read_count = 0
+        self.shm_index = None
 
     def add_handle(self, handle:str):
         self.handlers.append(handle)
 
 class DriverManager():
     
-    def __init__(self, use_processes:bool=False, status_file_path:str='') -> None:
+    def __init__(self, use_processes:bool=False, status_file_path:str='', log_level:int=logging.INFO) -> None:
         """
 
         :param use_processes: Allows to use processes instead of threads.
             it will have impact in performance and used resources
 
-        :param log_level: Sets the logging level.
+        :param status_file_path: (optional) File where the Driver Manager status is written every second.
+
+        :param log_level: Sets the logging level. Logs below this level are discarded.
 
         
         """      
-        self._logs = []
+        self._log_level = log_level
+        self._logs = collections.deque(maxlen=10000) # Capped, since logs are only trimmed when the status file is written
         self._use_processes = use_processes
         self._status_file_path = status_file_path
         self._drivers = {} # Dict to store drivers: {<driver_name>:<driver_struct>}
         self._driver_counter = 0
-        self._handles = {} # Dict to store variables data: {<handle>: (<var_id>, <driver name>)}
+        self._handles = {} # Dict to store variables data: {<handle>: (<var_id>, <driver_struct>, <var_struct>)}
+        self._handle_table = [] # Same entries as _handles, indexed by a dense handle id
+        self._handle_ids = {} # Dict to find the handle ids: {<handle>: <handle_id>}
+        self._open_incoming()
+        self._driver_index = {} # Dict to find drivers from their class and parameters: {(<class_name>, <parameters>): <driver_struct>}
+        self._pending_drivers = set() # Drivers with variable updates pending to be sent
+        self._running_drivers = set() # Drivers which status is RUNNING
         self.log("info", f"Driver Manager: Started v{VERSION}")     
         if self._status_file_path:    
             self.log("info", f"Driver Manager: Status File path is {self._status_file_path}")
@@ -132,45 +260,58 @@ class DriverManager():
         self._start_time = int(time.perf_counter())
         self._last_status_record = 0
         self._save_status_time = 0
+        self._status_executor = None
+        self._status_future = None
     
     def log(self, level:str="", message:str=""):
         """
-        TODO
+        Stores a log message to be written in the status file.
+
+        :param level: Log level name, see LOG_LEVELS. Unknown levels are handled as errors.
+
+        :param message: Log message
         """
-        if True:
+        if LOG_LEVELS.get(level, logging.ERROR) >= self._log_level:
             self._logs.append((time.perf_counter(), level, message))
     
     def save_status(self, now_sec:int):
         """
-        TODO:
+        Builds the status report and writes it to the status file in a background thread.
+        If the previous write is not completed yet, the report is skipped.
+        """
+        if self._status_future is not None and not self._status_future.done():
+            return
+        try:
+            sep = '-'*100+'\n'
+            parts = [f'Driver Manager status: (clock = {now_sec}s, {round(self._save_status_time*1000,2)}ms to write)\n', sep]
+            for driver_struct in self._drivers.values():
+                # Consecutive lines are formatted together to reduce the number of strings built
+                parts.append(f' {driver_struct.name}:\n   - Type = {driver_struct.class_name}, Status = {driver_struct.status.value}\n   - {driver_struct.latency}\n   - Info:\n')
+                parts.extend(f'     * {info_line}\n' for info_line in driver_struct.info_log)
+                parts.append(f'   - Parameters = {driver_struct.parameters}\n   - Handles = {driver_struct.handlers}, Variable count = {len(driver_struct.variables)}\n   - Variables:\n')
+                parts.extend(f'    - {var_id} {var_struct.handlers} = {var_struct.value}  (R:{var_struct.read_count} W:{var_struct.write_count}) - {var_struct.info}\n' for var_id, var_struct in driver_struct.variables.items())
+                parts.append(sep)
+            parts.append('\n')
+            parts.append('Logs: \n')
+            parts.extend(f'{round(timestamp,3)} - {level}: {message}\n' for (timestamp, level, message) in reversed(self._logs))
+            parts.append(sep)
+            while len(self._logs) > 50:
+                self._logs.popleft()
+        except Exception as e:
+            self.log("error", f"Driver Manager: Status file cannot be written, {e}")
+            return
+        if self._status_executor is None:
+            self._status_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._status_future = self._status_executor.submit(self._write_status_file, ''.join(parts))
+
+    def _write_status_file(self, report:str):
+        """
+        Writes the given report to the status file. Runs in the status writer thread.
         """
         start = time.perf_counter()
         try:
             with open(self._status_file_path, 'w') as f:
-                N = 100
-                f.write(f'Driver Manager status: (clock = {now_sec}s, {round(self._save_status_time*1000,2)}ms to write)\n')
-                f.write('-'*N+'\n')
-                for driver_struct in self._drivers.values():
-                    f.write(f' {driver_struct.name}:\n') 
-                    f.write(f'   - Type = {driver_struct.class_name}, Status = {driver_struct.status.value}\n')
-                    f.write(f'   - {driver_struct.latency}\n')
-                    f.write(f'   - Info:\n')
-                    for info_line in driver_struct.info_log:
-                        f.write(f'     * {info_line}\n')
-                    f.write(f'   - Parameters = {driver_struct.parameters}\n')
-                    f.write(f'   - Handles = {driver_struct.handlers}, Variable count = {len(driver_struct.variables)}\n')
-                    f.write(f'   - Variables:\n')
-                    for var_id, var_struct in driver_struct.variables.items():
-                        f.write(f'    - {var_id} {var_struct.handlers} = {var_struct.value}  (R:{var_struct.read_count} W:{var_struct.write_count}) - {var_struct.info}\n')
-                    f.write('-'*N+'\n')
-                f.write('\n')
-                f.write('Logs: \n')
-                old_logs = self._logs[-50:]
-                while self._logs:
-                    (timestamp, level, message) = self._logs.pop()
-                    f.write(f'{round(timestamp,3)} - {level}: {message}\n')
-                f.write('-'*N+'\n')
-                self._logs = old_logs
+                f.write(report)
         except Exception as e:
             self.log("error", f"Driver Manager: Status file cannot be written, {e}")
         self._save_status_time = time.perf_counter() - start
@@ -184,6 +325,8 @@ class DriverManager():
         :returns: Data returned by the command
 
         Class to help testing drivers.
+
+        NOTE: Variable updates are buffered, flush_updates() sends them to the drivers. It is called by run_once().
         """
         ret_data = None
 
@@ -196,81 +339,128 @@ class DriverManager():
             self.log("info", "Driver Manager: Setup Drivers request received")
             ret_data = self.setup_drivers(data)
         elif command == DriverMgrCommands.UPDATES:
-            for var_handle, var_value in data.items():
-                (var_id, driver_name) = self._handles.get(var_handle, (None, None))
-                if driver_name:
-                    if self._drivers[driver_name].status == DriverStatus.RUNNING:
-                        if self._drivers[driver_name].variables[var_id].value != var_value:
-                            self._drivers[driver_name].updates[var_id] = var_value    
-                            self._drivers[driver_name].variables[var_id].write_count += 1
-                            self._drivers[driver_name].variables[var_id].value = var_value 
-                else:
-                    self.log("error", f"Driver Manager: Variable handle not found! {var_handle} value = {var_value}")
-            for driver_struct in self._drivers.values():
-                if driver_struct.updates:
-                    driver_struct.pipe.send((DriverActions.UPDATE, driver_struct.updates))
-                    driver_struct.updates = {}
+            handles = self._handles # Read-only snapshot, see setup_drivers()
+            self.write_variables((var_handle, handles.get(var_handle, None), var_value) for var_handle, var_value in data.items())
+        elif command == DriverMgrCommands.UPDATES_BY_ID:
+            # Invalid ids are logged and skipped by write_variables()
+            handle_table = self._handle_table # Read-only snapshot, see setup_drivers()
+            table_size = len(handle_table)
+            self.write_variables((handle_id, handle_table[handle_id] if isinstance(handle_id, int) and 0 <= handle_id < table_size else None, var_value) for handle_id, var_value in data.items())
+        elif command == DriverMgrCommands.HANDLE_IDS:
+            handle_ids = self._handle_ids
+            if data is None:
+                ret_data = dict(handle_ids)
+            else:
+                ret_data = {var_handle: handle_ids.get(var_handle, None) for var_handle in data}
         else:
             self.log("error", f"Driver Manager: Command not implemented!!!! {command}")
         return ret_data
     
+    def write_variables(self, updates:any) -> None:
+        """
+        Buffers variable updates to be sent to the drivers, see flush_updates().
+
+        :param updates: Iterable of (<var_handle or handle id>, <handle entry>, <value>), where the handle entry is 
+            (<var_id>, <driver_struct>, <var_struct>) or None if the handle is not found.
+        """
+        running_drivers = self._running_drivers
+        for var_handle, entry, var_value in updates:
+            if entry is not None:
+                (var_id, driver_struct, var_struct) = entry
+                if driver_struct in running_drivers:
+                    if var_struct.value != var_value:
+                        if driver_struct.shared_values is not None and driver_struct.shared_values.write(SharedValues.TO_DRIVER, var_id, var_value):
+                            driver_struct.shared_updates = True
+                            driver_struct.updates.pop(var_id, None) # Older value buffered for the pipe
+                        else:
+                            driver_struct.updates[var_id] = var_value    
+                        self._pending_drivers.add(driver_struct)
+                        var_struct.write_count += 1
+                        var_struct.value = var_value 
+            else:
+                self.log("error", f"Driver Manager: Variable handle not found! {var_handle} value = {var_value}")
+
+    def flush_updates(self) -> None:
+        """
+        Sends the variable updates buffered by send_command() to the drivers, one message per driver.
+        """
+        while self._pending_drivers:
+            driver_struct = self._pending_drivers.pop()
+            if driver_struct.updates or driver_struct.shared_updates:
+                driver_struct.pipe.send((DriverActions.UPDATE, driver_struct.updates))
+                driver_struct.updates = {}
+                driver_struct.shared_updates = False
+
     def run_once(self, max_pipe_loops:int=10)->bool:
         """
         Executes the logic once to check if there is any update from a driver.
 
-        :param max_pipe_loops: limits the amount of checks done in each driver pipe to limit the running execution time,
+        :param max_pipe_loops: limits the amount of messages processed per driver to limit the running execution time,
 
         :returns: True if there is any update data to be retrieved, getUpdates() should be called.
         """
-        for driver_struct in self._drivers.values():
-            counter = 0
-            while driver_struct.pipe.poll():
-                (command, data) = driver_struct.pipe.recv()
-                if command == DriverActions.STATUS:
-                    if driver_struct.status != data:
-                        driver_struct.status = data
-                        for handle in driver_struct.handlers:
-                            self._status_updates.update({handle: data})
-                elif command == DriverActions.INFO:
-                    if "Latency" in data:
-                        driver_struct.latency = data
+        # Variable updates buffered by send_command()
+        self.flush_updates()
+
+        # Messages from all drivers are queued together in the incoming channel
+        counter = 0
+        max_loops = max_pipe_loops * max(1, len(self._drivers))
+        incoming = self._incoming
+        status_updates = self._status_updates
+        info_updates = self._info_updates
+        var_info_updates = self._var_info_updates
+        value_updates = self._value_updates
+        while counter < max_loops and incoming.poll():
+            (driver_struct, command, data) = incoming.recv()
+            if command == DriverActions.STATUS:
+                if driver_struct.status != data:
+                    driver_struct.status = data
+                    if data == DriverStatus.RUNNING:
+                        self._running_drivers.add(driver_struct)
                     else:
-                        driver_struct.info_log.append(data)
-                        if len(driver_struct.info_log) > 5: driver_struct.info_log = driver_struct.info_log[-5:]
-                        driver_struct.info = data
-                        for handle in driver_struct.handlers:
-                            self._info_updates.update({handle: data})       
-                elif command == DriverActions.VAR_INFO:
-                    (msg, var_id) = data
-                    var_struct = driver_struct.variables.get(var_id, None)
+                        self._running_drivers.discard(driver_struct)
+                    for handle in driver_struct.handlers:
+                        status_updates[handle] = data
+            elif command == DriverActions.INFO:
+                if "Latency" in data:
+                    driver_struct.latency = data
+                else:
+                    driver_struct.info_log.append(data)
+                    driver_struct.info = data
+                    for handle in driver_struct.handlers:
+                        info_updates[handle] = data
+            elif command == DriverActions.VAR_INFO:
+                (msg, var_id) = data
+                var_struct = driver_struct.variables.get(var_id, None)
+                if var_struct is not None:
+                    if var_struct.info != msg:
+                        var_struct.info = msg
+                        for handle in var_struct.handlers:
+                            var_info_updates[handle] = msg
+            elif command == DriverActions.UPDATE:
+                if driver_struct.shared_values is not None:
+                    data.update(driver_struct.shared_values.read(SharedValues.FROM_DRIVER))
+                variables = driver_struct.variables
+                for var_id, value in data.items():
+                    var_struct = variables.get(var_id, None)
                     if var_struct is not None:
-                        if var_struct.info != msg:
-                            var_struct.info = msg
+                        if var_struct.value != value:
+                            var_struct.value = value
+                            var_struct.read_count += 1
                             for handle in var_struct.handlers:
-                                self._var_info_updates.update({handle: msg})       
-                elif command == DriverActions.UPDATE:
-                    for var_id, value in data.items():
-                        var_struct = driver_struct.variables.get(var_id, None)
-                        if var_struct is not None:
-                            if var_struct.value != value:
-                                var_struct.value = value
-                                var_struct.read_count += 1
-                                for handle in var_struct.handlers:
-                                    self._value_updates.update({handle: value})       
-                else:
-                    self.log("error", f"Driver Manager: Message received from {driver_struct.name}, {command} -> {data}")
-                counter += 1
-                if counter>=max_pipe_loops: 
-                    break
+                                value_updates[handle] = value
+            else:
+                self.log("error", f"Driver Manager: Message received from {driver_struct.name}, {command} -> {data}")
+            counter += 1
 
         # Write status file
         now_sec = int(time.perf_counter()) - self._start_time
         if now_sec - self._last_status_record >= 1:
             self._last_status_record = now_sec
-            self._stats_updates = {
+            self._stats_updates.update({
                 "DRIVER_COUNT":len(self._drivers),
                 "VARIABLE_COUNT":len(self._handles),
-                }
+                })
             if self._status_file_path:
                 self.save_status(now_sec)
 
@@ -282,12 +472,9 @@ class DriverManager():
 
         :returns: status_updates, info_updates, var_info_updates, value_updates, stats_updates (every second)
         """
-        res = (copy.copy(self._status_updates), copy.copy(self._info_updates), copy.copy(self._var_info_updates), copy.copy(self._value_updates), copy.copy(self._stats_updates))
-        self._status_updates = {}
-        self._info_updates = {}
-        self._var_info_updates = {}
-        self._value_updates = {}
-        self._stats_updates = {}
+        # The dicts are handed over to the caller, new ones are used for the next updates
+        res = (self._status_updates, self._info_updates, self._var_info_updates, self._value_updates, self._stats_updates)
+        (self._status_updates, self._info_updates, self._var_info_updates, self._value_updates, self._stats_updates) = ({}, {}, {}, {}, {})
         return res
 
     def run_forever(self, pipe) -> None:
@@ -296,46 +483,43 @@ class DriverManager():
         """
         self.log("info", "Driver Manager: Running")
         while self._running:
-            can_sleep = True
+            # Wait until there are commands or driver messages, releasing CPU usage meanwhile
+            ready = multiprocessing.connection.wait([pipe, self._incoming], timeout=1e-3)
+
             # Send commands
-            counter = 0
-            try:
-                while pipe.poll():
-                    can_sleep = False
-                    (command, data) = pipe.recv()
-                    res_data = self.send_command(command, data)
-                    if res_data is not None:
-                        pipe.send((command, res_data))
-                    counter += 1
-                    if counter>=10: 
-                        break
-            except:
-                pass
+            if pipe in ready:
+                counter = 0
+                try:
+                    while pipe.poll():
+                        (command, data) = pipe.recv()
+                        res_data = self.send_command(command, data)
+                        if res_data is not None:
+                            pipe.send((command, res_data))
+                        counter += 1
+                        if counter>=10: 
+                            break
+                except:
+                    pass
+                # Updates received in several commands are sent together
+                self.flush_updates()
                 
             # Run Once and return updates
             if self._running:
                 if self.run_once():
-                    can_sleep = False
-                    if self._status_updates:
-                        pipe.send((DriverMgrCommands.STATUS, self._status_updates))
-                        self._status_updates = {}
-                    if self._info_updates:
-                        pipe.send((DriverMgrCommands.INFO, self._info_updates))
-                        self._info_updates = {}
-                    if self._var_info_updates:
-                        pipe.send((DriverMgrCommands.VAR_INFO, self._var_info_updates))
-                        self._var_info_updates = {}
-                    if self._value_updates:
-                        pipe.send((DriverMgrCommands.UPDATES, self._value_updates))
-                        self._value_updates = {}
-                    if self._stats_updates:
-                        pipe.send((DriverMgrCommands.STATS, self._stats_updates))
-                        self._stats_updates = {}
-
-            # Sleep if nothing happens to release CPU usage
-            if can_sleep:
-                time.sleep(1e-3)
+                    # Dicts are pickled when sent, so they can be cleared and reused
+                    for command, updates in ((DriverMgrCommands.STATUS, self._status_updates), 
+                                             (DriverMgrCommands.INFO, self._info_updates), 
+                                             (DriverMgrCommands.VAR_INFO, self._var_info_updates), 
+                                             (DriverMgrCommands.UPDATES, self._value_updates), 
+                                             (DriverMgrCommands.STATS, self._stats_updates)):
+                        if updates:
+                            pipe.send((command, updates))
+                            updates.clear()
                 
+        if self._status_executor is not None:
+            self._status_executor.shutdown(wait=True)
+            self._status_executor = None
+        self._close_incoming()
         self.log("info", "Driver Manager: Closed")
     
     def setup_drivers(self, drivers_setup_data:dict)->dict:
@@ -343,6 +527,10 @@ class DriverManager():
         TODO:
         """
         res = {}
+        # Handles are published as new containers once setup is done, so readers never see them being mutated
+        handles = dict(self._handles)
+        handle_table = list(self._handle_table)
+        handle_ids = dict(self._handle_ids)
         for driver_handle, driver_data in drivers_setup_data.items():
             driver_struct = self.find_compatible_driver(driver_data)
             if driver_struct is not None:
@@ -354,13 +542,23 @@ class DriverManager():
                 driver_struct = self.start_driver(driver_handle, driver_data)
                 if driver_struct is not None:
                     self._drivers[driver_struct.name] = driver_struct
+                    self._driver_index[_driver_key(driver_data)] = driver_struct
                     self.log("info", f"Driver Manager: New Driver started {driver_struct.name} -> {driver_struct.class_name}")
                     res[driver_handle] = "SUCCESS"
                 else:
                     res[driver_handle] = "FAILED"
             if driver_struct is not None:
                 setup_data = driver_data.get("SETUP", {})
-                self._handles.update(driver_struct.add_driver_variables(setup_data.get("variables", {})))
+                for var_handle, entry in driver_struct.add_driver_variables(setup_data.get("variables", {})).items():
+                    handles[var_handle] = entry
+                    if var_handle in handle_ids:
+                        handle_table[handle_ids[var_handle]] = entry # Handle set up again, keeps its id
+                    else:
+                        handle_ids[var_handle] = len(handle_table)
+                        handle_table.append(entry)
+        self._handles = handles
+        self._handle_table = handle_table
+        self._handle_ids = handle_ids
         return res
     
     def clean_drivers(self)->True:
@@ -374,7 +572,32 @@ class DriverManager():
         while self._drivers:
             driver_name, driver_struct = self._drivers.popitem()
             driver_struct.process.join()
+            # The drain thread stops on the EXIT status, or on EOF once the driver process is gone
+            if driver_struct.drain_thread is not None:
+                driver_struct.drain_thread.join()
+            driver_struct.pipe.close()
+            if driver_struct.shared_values is not None:
+                driver_struct.shared_values.close(unlink=True)
             self.log("info", f"Driver Manager: Driver {driver_name} closed")
+        self._driver_index = {}
+        self._pending_drivers = set()
+        self._running_drivers = set()
+        # Messages left from the closed drivers are discarded
+        self._close_incoming()
+        self._open_incoming()
+
+    def _open_incoming(self) -> None:
+        """ Creates the channel where messages from all drivers are queued: (<driver_struct>, <command>, <data>). Thread drivers 
+        send to it directly, process drivers through their drain thread.
+        """
+        self._incoming_channel = _ThreadPipe._channel()
+        self._incoming = _ThreadPipe(self._incoming_channel, None)
+        self._incoming_writer = _ThreadPipe(None, self._incoming_channel)
+
+    def _close_incoming(self) -> None:
+        """ Closes both ends of the channel where messages from all drivers are queued. """
+        self._incoming_writer.close()
+        self._incoming.close()
     
     def start_driver(self, driver_handle:str, driver_data:dict) -> DriverStructure:
         """ Starts a new Driver Process using the given parameters. 
@@ -392,16 +615,67 @@ class DriverManager():
             driver_name = f"DRIVER_{self._driver_counter}"
             setup_data = driver_data.get("SETUP", {})
             parameters = setup_data.get("parameters", None)
-            pipe, driver_pipe = multiprocessing.Pipe()
             if self._use_processes:
-                driver_proc = multiprocessing.Process(target=RunDriver, args=(driver_class, driver_name, driver_pipe, parameters,), daemon=True)
+                pipe, driver_pipe = multiprocessing.Pipe()
+                shared_values = SharedValues()
+                driver_proc = multiprocessing.Process(target=RunDriver, args=(driver_class, driver_name, driver_pipe, parameters, shared_values.name, shared_values.lock,), daemon=True)
+                new_driver = DriverStructure(driver_class_name, driver_name, driver_handle, parameters, pipe, driver_proc, shared_values)
+                driver_proc.start()
+                driver_pipe.close() # Only the driver process keeps this end, so the drain thread gets EOF when it ends
+                self.set_driver_affinity(driver_name, driver_proc, parameters)
+                new_driver.drain_thread = threading.Thread(target=self._drain_pipe, args=(new_driver,), daemon=True)
+                new_driver.drain_thread.start()
             else:
+                # Threads share memory, so neither pickling nor shared values are needed, and messages are queued 
+                # directly in the incoming channel, tagged with the driver they come from
+                to_driver = _ThreadPipe._channel()
+                pipe = _ThreadPipe(None, to_driver)
+                driver_pipe = _ThreadPipe(to_driver, self._incoming_channel)
                 driver_proc = threading.Thread(target=RunDriver, args=(driver_class, driver_name, driver_pipe, parameters,), daemon=True)
-            driver_proc.start()
-            new_driver = DriverStructure(driver_class_name, driver_name, driver_handle, parameters, pipe, driver_proc)
+                new_driver = DriverStructure(driver_class_name, driver_name, driver_handle, parameters, pipe, driver_proc)
+                driver_pipe.tag = new_driver
+                driver_proc.start()
             return new_driver
         return None
     
+    def _drain_pipe(self, driver_struct:DriverStructure) -> None:
+        """ Receives the messages from a driver process and queues them to be processed by run_once(). Runs in its own thread 
+        until the driver reports the EXIT status or its pipe is closed.
+
+        :param driver_struct: Driver to receive messages from
+        """
+        while True:
+            try:
+                (command, data) = driver_struct.pipe.recv()
+                self._incoming_writer.send((driver_struct, command, data))
+            except Exception:
+                break
+            if command == DriverActions.STATUS and data == DriverStatus.EXIT:
+                break
+
+    def set_driver_affinity(self, driver_name:str, driver_proc:multiprocessing.Process, parameters:dict) -> None:
+        """ Pins a driver process to a CPU to avoid it being moved between CPUs. Only supported on Linux.
+        Drivers are only pinned if the 'cpu_affinity' parameter gives a CPU number or a list of them.
+
+        :param driver_name: Driver name
+
+        :param driver_proc: Driver process already started
+
+        :param parameters: Driver setup parameters. (See documentation)
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        cpu_affinity = (parameters or {}).get('cpu_affinity', None)
+        if cpu_affinity is None or cpu_affinity is False:
+            return
+        try:
+            if isinstance(cpu_affinity, int):
+                cpu_affinity = {cpu_affinity}
+            os.sched_setaffinity(driver_proc.pid, set(cpu_affinity))
+            self.log("info", f"Driver Manager: Driver {driver_name} pinned to CPU {sorted(cpu_affinity)}")
+        except Exception as e:
+            self.log("error", f"Driver Manager: Driver {driver_name} CPU affinity cannot be set, {e}")
+
     def find_compatible_driver(self, driver_data: dict) -> DriverStructure:
         """ Finds a compatible driver comparing the class and setup parameters within the existing ones. 
 
@@ -409,7 +683,12 @@ class DriverManager():
 
         :returns: DriverStructure if compatible driver found or None if note
         """
+        # Drivers setup with exactly the same parameters are found directly
+        driver_key = _driver_key(driver_data)
+        driver_structure = self._driver_index.get(driver_key, None)
+        if driver_structure is not None:
+            return driver_structure
         for driver_structure in self._drivers.values():
-            if driver_structure.is_compatible(driver_data):
+            if driver_structure.is_compatible(driver_data, driver_key):
                 return driver_structure
         return None
\ No newline at end of file
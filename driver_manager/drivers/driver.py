@@ -15,8 +15,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import multiprocessing
+import multiprocessing.shared_memory
 import time
 import enum
+import math
+
+import numpy as np
 
 class DriverStatus(str, enum.Enum):
     STANDBY = 'STANDBY'
@@ -53,6 +57,209 @@ class VariableOperation(str, enum.Enum):
     WRITE = 'write'
     BOTH = 'both'
 
+def _boolFromString(str_value:any) -> bool:
+    if isinstance(str_value, str):
+        return str_value in ['True','true']
+    return bool(str_value)
+
+def _intFromString(str_value:any) -> int:
+    try:
+        return int(str_value)
+    except Exception:
+        return None
+
+def _floatFromString(str_value:any) -> float:
+    try:
+        return float(str_value)
+    except Exception:
+        return None
+
+def _valueFromString(str_value:any) -> any:
+    return str_value
+
+# Functions to convert a value from string depending on the variable datatype
+STRING_CONVERTERS = {
+    VariableDatatype.BOOL: _boolFromString,
+    VariableDatatype.BYTE: _intFromString,
+    VariableDatatype.INTEGER: _intFromString,
+    VariableDatatype.WORD: _intFromString,
+    VariableDatatype.DWORD: _intFromString,
+    VariableDatatype.QWORD: _intFromString,
+    VariableDatatype.FLOAT: _floatFromString,
+}
+
+class SharedValues():
+    """ Table of numeric variable values placed in shared memory, used to exchange variable updates between
+    the Driver Manager and a driver without pickling them. The pipe is then only used to signal that there are updates.
+
+    The memory block contains a header with the table size and two regions (TO_DRIVER and FROM_DRIVER), 
+    each one with <size> float64 values followed by <size> dirty flags.
+    Array variables use <variable size> consecutive slots, and only the dirty flag of the first one.
+    Both sides access the table holding the same lock, so values and dirty flags are always seen consistently.
+    """
+    TO_DRIVER = 0
+    FROM_DRIVER = 1
+    DEFAULT_SIZE = 1024
+    HEADER_SIZE = 8
+    MAX_EXACT_INT = 2**53 # float64 can store integers exactly up to this value
+
+    def __init__(self, size:int=DEFAULT_SIZE, name:str=None, lock:multiprocessing.Lock=None):
+        """
+        :param size: (optional) Amount of variables that fit in the table. Only used when creating a new table.
+        :param name: (optional) Name of an existing shared memory block to attach to. A new block is created if not given.
+        :param lock: (optional) Lock of the table, the one created with the block must be given when attaching to it.
+        """
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        if name is None:
+            self._shm = multiprocessing.shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + size*18)
+            np.ndarray((1,), dtype=np.uint64, buffer=self._shm.buf)[0] = size
+        else:
+            self._shm = multiprocessing.shared_memory.SharedMemory(name=name)
+            size = int(np.ndarray((1,), dtype=np.uint64, buffer=self._shm.buf)[0])
+        self.name = self._shm.name
+        self.size = size
+        self._values = []
+        self._dirty = []
+        offset = self.HEADER_SIZE
+        for _ in (self.TO_DRIVER, self.FROM_DRIVER):
+            self._values.append(np.ndarray((size,), dtype=np.float64, buffer=self._shm.buf, offset=offset))
+            self._dirty.append(np.ndarray((size,), dtype=np.uint8, buffer=self._shm.buf, offset=offset+size*8))
+            offset += size*9
+        self._var_ids = [] # Variable id stored in each slot
+        self._converters = [] # Function used to convert back the stored float64 in each slot
+        self._widths = [] # Amount of slots used by the variable stored in each slot
+        self._slots = {} # Dict to find the slot of each variable: {<var_id>: <slot>}
+
+    @staticmethod
+    def getConverter(var_data:dict) -> any:
+        """ Returns the function to convert back a shared value to the variable datatype.
+
+        :param var_data: Variable setup data. (See documentation)
+
+        :returns: Converter function, or None if the variable cannot be shared (datatype not supported)
+        """
+        try:
+            datatype = VariableDatatype(var_data.get('datatype'))
+        except ValueError:
+            return None
+        if datatype == VariableDatatype.BOOL:
+            return bool
+        elif datatype in [VariableDatatype.BYTE, VariableDatatype.INTEGER, VariableDatatype.WORD, VariableDatatype.DWORD]:
+            return int
+        elif datatype == VariableDatatype.FLOAT:
+            return float
+        return None
+
+    def addVariable(self, var_id:str, var_data:dict, slot:int=None) -> int:
+        """ Assigns a slot of the table to a variable.
+
+        :param var_id: Variable id
+        :param var_data: Variable setup data. (See documentation)
+        :param slot: (optional) Slot to use, already assigned by the other side. Next free slot is used if not given.
+
+        :returns: The slot assigned, or None if the variable cannot be shared
+        """
+        converter = self.getConverter(var_data)
+        if converter is None:
+            return None
+        width = max(1, var_data.get('size', 1))
+        if slot is None:
+            slot = len(self._var_ids)
+        if slot + width > self.size:
+            return None
+        while len(self._var_ids) < slot + width:
+            self._var_ids.append(None)
+            self._converters.append(None)
+            self._widths.append(0)
+        self._var_ids[slot] = var_id
+        self._converters[slot] = converter
+        self._widths[slot] = width
+        self._slots[var_id] = (slot, width)
+        return slot
+
+    @classmethod
+    def isExact(cls, converter:any, value:any) -> bool:
+        """ Checks if a value is stored and converted back without changes.
+
+        :param converter: Converter function of the slot, see getConverter()
+        :param value: Single value
+
+        :returns: True if the value already has the type given by the converter and fits in a float64
+        """
+        value_type = type(value)
+        if converter is float:
+            return value_type is float and math.isfinite(value)
+        elif converter is int:
+            return value_type is int and abs(value) <= cls.MAX_EXACT_INT
+        return value_type is bool and converter is bool
+
+    def write(self, region:int, var_id:str, value:any) -> bool:
+        """ Writes a variable value into the given region and marks it as dirty.
+        Only values that are read back exactly the same are written, so the result does not depend on the path used.
+
+        :param region: TO_DRIVER or FROM_DRIVER
+        :param var_id: Variable id
+        :param value: Variable value
+
+        :returns: True if the value has been written, or False if it should be sent using the pipe instead
+        """
+        slot, width = self._slots.get(var_id, (None, 0))
+        if slot is None:
+            return False
+        converter = self._converters[slot]
+        if width == 1:
+            written = self.isExact(converter, value)
+        else:
+            written = isinstance(value, (list, tuple)) and len(value) == width and all(self.isExact(converter, item) for item in value)
+        with self.lock:
+            if written:
+                if width == 1:
+                    self._values[region][slot] = value
+                else:
+                    self._values[region][slot:slot+width] = value
+            # A value sent through the pipe is newer than any pending shared one
+            self._dirty[region][slot] = 1 if written else 0
+        return written
+
+    def read(self, region:int) -> dict:
+        """ Reads all dirty values from the given region and clears their dirty flag.
+
+        :param region: TO_DRIVER or FROM_DRIVER
+
+        :returns: Dictionary with the updated values {<var_id>: <value>}
+        """
+        dirty = self._dirty[region]
+        values = self._values[region]
+        widths = self._widths
+        # Values are copied holding the lock, so none of them is read while being written
+        with self.lock:
+            slots = np.nonzero(dirty)[0].tolist()
+            if not slots:
+                return {}
+            dirty[slots] = 0
+            raw = [values[slot:slot+widths[slot]].tolist() for slot in slots]
+        var_ids = self._var_ids
+        converters = self._converters
+        res = {}
+        for slot, items in zip(slots, raw):
+            if widths[slot] == 1:
+                res[var_ids[slot]] = converters[slot](items[0])
+            else:
+                res[var_ids[slot]] = list(map(converters[slot], items))
+        return res
+
+    def close(self, unlink:bool=False):
+        """ Releases the shared memory block.
+
+        :param unlink: (optional) Destroys the block. Only the side that created it should do it.
+        """
+        self._values = []
+        self._dirty = []
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
 class driver():
     """
 
@@ -97,6 +304,8 @@ class driver():
         self.variables = {} # Dictionary to store variable data (definition and additional data specific to each driver)
         self.raw_variables_def = {} # Dictionary to store raw variable definition data, used to reset the driver
         self.pending_updates = {} # Pending variable updates to write on the driver {var_name: var_value}
+        self._last_written = {} # Last value successfully written on the driver {var_name: var_value}
+        self.shared_values = None # SharedValues table used to exchange scalar variable updates, if provided by the Driver Manager
 
         if self.pipe is None: 
             self.changeStatus(DriverStatus.EXIT)
@@ -135,6 +344,10 @@ class driver():
 
                         # Action ADD VARIABLES
                         elif action == DriverActions.ADD_VARIABLES:
+                            for var_id, var_data in data.items():
+                                slot = var_data.pop('shm_index', None)
+                                if self.shared_values is not None and slot is not None:
+                                    self.shared_values.addVariable(var_id, var_data, slot)
                             self.raw_variables_def.update(data)
                             self.changeStatus(self.status)
                             if self.status == DriverStatus.RUNNING:
@@ -143,6 +356,8 @@ class driver():
                                 
                         # Action UPDATE
                         elif action == DriverActions.UPDATE:
+                            if self.shared_values is not None and isinstance(data, dict):
+                                data.update(self.shared_values.read(SharedValues.TO_DRIVER))
                             if self.status == DriverStatus.RUNNING:
                                 if isinstance(data, dict):
                                     for var_name, var_value in data.items():
@@ -191,6 +406,9 @@ class driver():
             if self.rpi > 0:
                 time.sleep(self.rpi*5e-4) # Sleep 1/2 rpi in seconds
 
+        if self.shared_values is not None:
+            self.shared_values.close()
+            self.shared_values = None
 
     def loop(self):
         """ Runs every iteration while the driver is active. Only use if strictly necessary.
@@ -242,6 +460,9 @@ class driver():
         """
         try:
             if self.pipe:
+                if self.shared_values is not None:
+                    # Shared values are written directly, the pipe message only carries the rest and signals the update
+                    data = {var_id: value for var_id, value in data.items() if not self.shared_values.write(SharedValues.FROM_DRIVER, var_id, value)}
                 self.pipe.send((DriverActions.UPDATE, data))
         except:
             pass
@@ -274,6 +495,8 @@ class driver():
         """
         try:
             if variable_data is not None and self._connection is not None:
+                for var_id in variable_data:
+                    self._last_written.pop(var_id, None)
                 self.addVariables(variable_data)
                 return True
                 
@@ -289,6 +512,7 @@ class driver():
         try:
             self.disconnect()
             self.variables = {}        
+            self._last_written = {}
         except Exception as e:
             self.sendDebugInfo('Exception during cleanup: '+str(e)) 
         finally:
@@ -308,7 +532,13 @@ class driver():
             # Write variables from the server following the rpi
             if (now - self.last_write) >= (self.rpi*1e-3):
                 self.last_write = now
-                pending_writes = [(var_id, new_value) for var_id, new_value in self.pending_updates.items()]
+                pending_writes = []
+                for var_id, new_value in list(self.pending_updates.items()):
+                    # Skip values already written, forced writes below will still refresh them
+                    if var_id in self._last_written and self._last_written[var_id] == new_value:
+                        self.pending_updates.pop(var_id)
+                    else:
+                        pending_writes.append((var_id, new_value))
 
                 # Force write if necesary
                 if (self.force_write > 0) and (now - self.last_forced_write >= self.force_write):
@@ -323,6 +553,10 @@ class driver():
                 # Call write variables
                 if pending_writes:
                     for (var_id, value, quality) in self.writeVariables(pending_writes):
+                        if quality == VariableQuality.GOOD:
+                            self._last_written[var_id] = value
+                        else:
+                            self._last_written.pop(var_id, None)
                         if var_id in self.pending_updates:
                             self.pending_updates.pop(var_id)
                             if quality == VariableQuality.GOOD:
@@ -342,7 +576,11 @@ class driver():
                 if pending_reads:
                     self._transmit_read_counter += 1
                     updates = {}
+                    last_written = self._last_written
                     for (var_id, value, quality) in self.readVariables(pending_reads):
+                        # Value changed on the device side, so the next write of the last value can not be skipped
+                        if var_id in last_written and (quality != VariableQuality.GOOD or last_written[var_id] != value):
+                            last_written.pop(var_id)
                         if (quality == VariableQuality.GOOD):
                             if (self.variables[var_id]['value'] != value):
                                 self.variables[var_id]['value'] = value
@@ -380,23 +618,22 @@ class driver():
         : returns: the variable value in specific format or back as str by default. None if conversion not possible.
         """
         try:
-            if datatype == VariableDatatype.BOOL:
-                if isinstance(str_value, str):
-                    return str_value in ['True','true']
-                else:    
-                    return bool(str_value)
+            return self.getStringConverter(datatype)(str_value)
+        except Exception as e:
+            return None
 
-            elif datatype in [VariableDatatype.BYTE, VariableDatatype.INTEGER, VariableDatatype.WORD, VariableDatatype.DWORD, VariableDatatype.QWORD]:
-                return int(str_value)
 
-            elif datatype == VariableDatatype.FLOAT:
-                return float(str_value)
+    def getStringConverter(self, datatype:VariableDatatype) -> any:
+        """ Returns the function used by getValueFromString() to convert a value of the given datatype, so it can be resolved once per variable.
 
-            else:
-                return str_value
+        : param datatype: Variable datatype
 
-        except Exception as e:
-            return None
+        : returns: function taking the value in string format and returning it in the specific format, or None if conversion not possible.
+        """
+        try:
+            return STRING_CONVERTERS.get(datatype, _valueFromString)
+        except TypeError: # Unhashable datatype
+            return _valueFromString
 
 
     def defaultVariableValue(self, datatype: VariableDatatype, size:int=1) -> any:
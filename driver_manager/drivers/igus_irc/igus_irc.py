@@ -16,12 +16,26 @@
 
 import sys
 import os
+import re
+import operator
 import multiprocessing
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from .cri_lib import CRIController
 from ..driver import driver, VariableQuality, VariableOperation
 
+# Variable kinds
+KIND_AXIS = 0
+KIND_GSIG = 1
+KIND_DOUT = 2
+KIND_DIN = 3
+
+IGUS_IRC_KINDS = {'GSig': KIND_GSIG, 'DOut': KIND_DOUT, 'DIn': KIND_DIN}
+IGUS_IRC_MAX_INDEX = {KIND_GSIG: 99, KIND_DOUT: 63, KIND_DIN: 63}
+IGUS_IRC_VARIABLE = re.compile(r'^(GSig|DOut|DIn)(\d+)$')
+IGUS_IRC_JOINTS = operator.attrgetter('A1', 'A2', 'A3', 'A4', 'A5', 'A6') # Robot joint rotations of a JointsState as a tuple
+
 class igus_irc(driver):
     '''
     This driver uses the Igus CRI-Python API to communicate with the Igus robot simulator (https://github.com/CommonplaceRobotics/CRI-Python-Lib).
@@ -50,6 +64,11 @@ class igus_irc(driver):
         self.ip = '127.0.0.1'
         self.port = 3921
 
+        # Parsed variable ids {var_id: (kind, index)}
+        self._parsed = {}
+        # Buffer reused to round the joint values
+        self._axis = np.zeros(6, dtype=np.float64)
+
 
     def connect(self) -> bool:
         """ Connect driver.
@@ -84,32 +103,52 @@ class igus_irc(driver):
         """
         for var_id, var_data in variables.items():
             try:
+                var_id = sys.intern(var_id)
                 if var_id == 'Axis':
                     var_data['value'] = [None for i in range(var_data['size'])]
+                    self._parsed[var_id] = (KIND_AXIS, 0)
                     self.variables[var_id] = var_data
-                elif var_id[:4] in ["GSig", "DOut"] or var_id[:3]=="DIn":
-                    if var_id[:4] =="GSig":
-                        number = int(var_id[4:])-1
-                        assert 0<=number<=99
-                        if var_data['operation'] == VariableOperation.READ:
-                            var_data['value'] = None
-                        else:
-                            var_data['value'] = self._connection.robot_state.global_signals[number]
-                    else:
-                        if var_id[:4] =="DOut":
-                            number = int(var_id[4:])-1
-                            assert 0<=number<=63
+                else:
+                    match = IGUS_IRC_VARIABLE.match(var_id)
+                    if match:
+                        kind = IGUS_IRC_KINDS[match.group(1)]
+                        number = int(match.group(2))-1
+                        assert 0<=number<=IGUS_IRC_MAX_INDEX[kind]
+                        if kind == KIND_GSIG:
+                            if var_data['operation'] == VariableOperation.READ:
+                                var_data['value'] = None
+                            else:
+                                var_data['value'] = self._connection.robot_state.global_signals[number]
+                        elif kind == KIND_DOUT:
                             var_data['value'] = None
                         else:
-                            number = int(var_id[3:])-1
-                            assert 0<=number<=63
                             var_data['value'] = self._connection.robot_state.din[number]
-                    self.variables[var_id] = var_data
-                    self.sendDebugVarInfo((f'SETUP: Variable found {var_id}', var_id))
+                        self._parsed[var_id] = (kind, number)
+                        self.variables[var_id] = var_data
+                        self.sendDebugVarInfo((f'SETUP: Variable found {var_id}', var_id))
             except:
                 self.sendDebugVarInfo((f'SETUP: Variable not found {var_id}', var_id))
 
 
+    def _readAxis(self, number: int) -> list:
+        axis = self._axis
+        axis[:] = IGUS_IRC_JOINTS(self._connection.robot_state.joints_current) # robot joint rotations [Rax_1, Rax_2, Rax_3, Rax_4, Rax_5, Rax_6]
+        np.round(axis, 3, out=axis)
+        return axis.tolist() # New list every time, so the base driver can detect changes
+
+    def _readGlobalSignal(self, number: int) -> bool:
+        return self._connection.robot_state.global_signals[number]
+
+    def _readDigitalOutput(self, number: int) -> bool:
+        return self._connection.robot_state.dout[number]
+
+    def _writeGlobalSignal(self, number: int, value: bool):
+        self._connection.set_global_signal(number, value)
+
+    def _writeDigitalInput(self, number: int, value: bool):
+        self._connection.set_din(number, value)
+
+
     def readVariables(self, variables: list) -> list:
         """ Read given variable values. In case that the read is not possible or generates an error BAD quality should be returned.
         : param variables: List of variable ids to be read. 
@@ -117,20 +156,13 @@ class igus_irc(driver):
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
         res = []
+        readers = (self._readAxis, self._readGlobalSignal, self._readDigitalOutput, None)
         for var_id in variables:
             try:
-                if var_id == 'Axis':
-                    new_value = self._connection.robot_state.joints_current # robot joint rotations [Rax_1, Rax_2, Rax_3, Rax_4, Rax_5, Rax_6]
-                    new_value = [round(x,3) for x in [new_value.A1, new_value.A2, new_value.A3, new_value.A4, new_value.A5, new_value.A6]]
-                    res.append((var_id, new_value, VariableQuality.GOOD))
-                elif var_id[:4] == "DOut":
-                    number = int(var_id[4:])-1
-                    new_value = self._connection.robot_state.dout[number]
-                    res.append((var_id, new_value, VariableQuality.GOOD))
-                elif var_id[:4] == "GSig":
-                    number = int(var_id[4:])-1
-                    new_value = self._connection.robot_state.global_signals[number]
-                    res.append((var_id, new_value, VariableQuality.GOOD))
+                kind, number = self._parsed[var_id]
+                reader = readers[kind]
+                if reader is not None:
+                    res.append((var_id, reader(number), VariableQuality.GOOD))
             except:
                 res.append((var_id, self.variables[var_id]['value'], VariableQuality.BAD))
             
@@ -144,15 +176,13 @@ class igus_irc(driver):
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
         res = []
+        writers = (None, self._writeGlobalSignal, None, self._writeDigitalInput)
         for (var_id, new_value) in variables:
             try:
-                if var_id[:3] == "DIn":
-                    number = int(var_id[3:])-1
-                    self._connection.set_din(number,new_value)
-                    res.append((var_id, new_value, VariableQuality.GOOD))
-                elif var_id[:4] == "GSig":
-                    number = int(var_id[4:])-1
-                    self._connection.set_global_signal(number,new_value)
+                kind, number = self._parsed[var_id]
+                writer = writers[kind]
+                if writer is not None:
+                    writer(number, new_value)
                     res.append((var_id, new_value, VariableQuality.GOOD))
             except Exception as e:
                 res.append((var_id, new_value, VariableQuality.BAD))
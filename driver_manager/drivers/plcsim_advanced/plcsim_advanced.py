@@ -17,9 +17,14 @@
 import sys 
 import os
 import multiprocessing
+import operator
+import concurrent.futures
 
 from ..driver import driver, VariableQuality, VariableOperation, DriverStatus
 
+TYPE_GETTERS = {}
+TYPE_SETTERS = {}
+
 try:
     if os.name == 'nt':# Just try on windows
         import clr
@@ -34,16 +39,53 @@ try:
         else: # 32-Bit OS
             clr.FindAssembly("Siemens.Simatic.Simulation.Runtime.Api.x86")
             clr.AddReference("Siemens.Simatic.Simulation.Runtime.Api.x86")
-        from Siemens.Simatic.Simulation.Runtime import SimulationRuntimeManager, SDataValue, SDataValueByName, EPrimitiveDataType, ETagListDetails
+        from Siemens.Simatic.Simulation.Runtime import SimulationRuntimeManager, SDataValueByName, EPrimitiveDataType, ETagListDetails, SimulationRuntimeException, ERuntimeErrorCode
+        # Function to get the value from a SDataValue depending on its type
+        TYPE_GETTERS = {
+            EPrimitiveDataType.Bool: operator.attrgetter('Bool'),
+            EPrimitiveDataType.Int8: operator.attrgetter('Int8'),
+            EPrimitiveDataType.Int16: operator.attrgetter('Int16'),
+            EPrimitiveDataType.Int32: operator.attrgetter('Int32'),
+            EPrimitiveDataType.Int64: operator.attrgetter('Int64'),
+            EPrimitiveDataType.UInt8: operator.attrgetter('UInt8'),
+            EPrimitiveDataType.UInt16: operator.attrgetter('UInt16'),
+            EPrimitiveDataType.UInt32: operator.attrgetter('UInt32'),
+            EPrimitiveDataType.UInt64: operator.attrgetter('UInt64'),
+            EPrimitiveDataType.Float: operator.attrgetter('Float'),
+            EPrimitiveDataType.Double: operator.attrgetter('Double'),
+            EPrimitiveDataType.Char: operator.attrgetter('Char'),
+        }
+        # Function to set the value of a SDataValue depending on its type
+        TYPE_SETTERS = {
+            EPrimitiveDataType.Bool: lambda s, v: setattr(s, 'Bool', bool(v)),
+            EPrimitiveDataType.Int8: lambda s, v: setattr(s, 'Int8', v),
+            EPrimitiveDataType.Int16: lambda s, v: setattr(s, 'Int16', v),
+            EPrimitiveDataType.Int32: lambda s, v: setattr(s, 'Int32', v),
+            EPrimitiveDataType.Int64: lambda s, v: setattr(s, 'Int64', v),
+            EPrimitiveDataType.UInt8: lambda s, v: setattr(s, 'UInt8', v),
+            EPrimitiveDataType.UInt16: lambda s, v: setattr(s, 'UInt16', v),
+            EPrimitiveDataType.UInt32: lambda s, v: setattr(s, 'UInt32', v),
+            EPrimitiveDataType.UInt64: lambda s, v: setattr(s, 'UInt64', v),
+            EPrimitiveDataType.Float: lambda s, v: setattr(s, 'Float', v),
+            EPrimitiveDataType.Double: lambda s, v: setattr(s, 'Double', v),
+            EPrimitiveDataType.Char: lambda s, v: setattr(s, 'Char', v),
+        }
 except:
     pass
 
+def isNotUpToDate(e: Exception) -> bool:
+    """ Returns True if the exception was raised because the tag list of the instance is not up to date.
+    """
+    return isinstance(e, SimulationRuntimeException) and e.RuntimeErrorCode == ERuntimeErrorCode.NotUpToDate
+
 class plcsim_advanced(driver):
     '''
     Driver that can be used together with a local PLCSim Advanced Instance, using the Simulation Runtime API.
     Parameters:
     instanceName : The name of the PLC Sim Advanced Instance
     HMIVisibleTagsOnly (bool): Browse HMI visible tags only. Default True
+    pipelineReads (bool): Read the signals for the next poll in a background thread while the current one is processed.
+        Values are then reported one poll later. Default False
     '''
 
     def __init__(self, name: str, pipe: multiprocessing.Pipe = None, params:dict = None):
@@ -56,6 +98,21 @@ class plcsim_advanced(driver):
         # Parameters
         self.instanceName = "s7-1500"
         self.HMIVisibleTagsOnly = True
+        self.pipelineReads = False
+        # Variable tables, indexed by the position of each variable in _names
+        self._idx = {} # {var_id: index}
+        self._names = []
+        self._sdvbn = [] # SDataValueByName used to write each variable
+        self._read_sdvbn = [] # SDataValueByName used to read each variable, never changed by the writes
+        self._sdv = [] # SDataValue used to write each variable, keeps its type
+        self._getters = [] # Function to get the value from the SDataValue of each variable
+        self._setters = [] # Function to set the value of the SDataValue of each variable
+        # Read cache, rebuilt when the variables to read change
+        self._read_ids = []
+        self._read_signals = []
+        self._read_getters = []
+        self._executor = None # Single worker running ReadSignals and WriteSignals if pipelineReads, so they never overlap
+        self._read_future = None # Pending ReadSignals for the cached variables, if pipelineReads
         
     def connect(self) -> bool:
         """ Connect driver.
@@ -81,7 +138,17 @@ class plcsim_advanced(driver):
     def disconnect(self):
         """ Disconnect driver.
         """
-        pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._read_future = None
+
+    def waitPendingRead(self):
+        """ Waits for the pipelined read to finish and discards it, so the connection can be used from the driver thread.
+        """
+        if self._read_future is not None:
+            concurrent.futures.wait([self._read_future])
+            self._read_future = None
 
     def addVariables(self, variables: dict):
         """ Add variables to the driver. Correctly added variables will be added to internal dictionary 'variables'.
@@ -89,18 +156,38 @@ class plcsim_advanced(driver):
         : param variables: Variables to add in a dict following the setup format. (See documentation) 
         
         """
+        self.waitPendingRead()
         self._connection.UpdateTagList(ETagListDetails.IOMCTDB, self.HMIVisibleTagsOnly) # Update all IO, M, CT and DB.
-        for var_id in list(variables.keys()):
+        self._read_ids = [] # Force read cache rebuild
+        for var_id, var_data in variables.items():
             try:
-                var_data = dict(variables[var_id])
-                var_data['SDataValueByName'] = SDataValueByName()
-                var_data['SDataValueByName'].Name = var_id
-                var_data['SDataValueByName'].DataValue = self._connection.Read(var_data['SDataValueByName'].Name)
-                var_data['PrimitiveDataType'] = var_data['SDataValueByName'].DataValue.Type
+                var_id = sys.intern(var_id)
+                sdvbn = SDataValueByName()
+                sdvbn.Name = var_id
+                sdvbn.DataValue = self._connection.Read(sdvbn.Name)
+                primitive_type = sdvbn.DataValue.Type
+                read_sdvbn = SDataValueByName()
+                read_sdvbn.Name = var_id
+                read_sdvbn.DataValue = sdvbn.DataValue # SDataValue is a struct, so this is a copy
                 if var_data['operation'] == VariableOperation.READ:
                     var_data['value'] = None # Force first update
                 else:
                     var_data['value'] = self.defaultVariableValue(var_data['datatype'], var_data['size'])
+                index = self._idx.get(var_id, None)
+                if index is None:
+                    index = len(self._names)
+                    self._idx[var_id] = index
+                    self._names.append(var_id)
+                    self._sdvbn.append(None)
+                    self._read_sdvbn.append(None)
+                    self._sdv.append(None)
+                    self._getters.append(None)
+                    self._setters.append(None)
+                self._sdvbn[index] = sdvbn
+                self._read_sdvbn[index] = read_sdvbn
+                self._sdv[index] = sdvbn.DataValue
+                self._getters[index] = TYPE_GETTERS.get(primitive_type, None)
+                self._setters[index] = TYPE_SETTERS.get(primitive_type, None)
                 self.variables[var_id] = var_data
             except Exception as e:
                 self.sendDebugVarInfo(('SETUP: Bad variable definition: {}'.format(var_id), var_id))
@@ -110,45 +197,38 @@ class plcsim_advanced(driver):
         : param variables: List of variable ids to be read. 
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
-        signals = []
-        res = []
+        GOOD = VariableQuality.GOOD
+        BAD = VariableQuality.BAD
+        res = [None]*len(variables)
         try:
-            for var_id in variables:
-                signals.append(self.variables[var_id]['SDataValueByName'])
-            signals = self._connection.ReadSignals(signals)
-            for signal in signals:
-                var_id = signal.Name
-                if signal.DataValue.Type == EPrimitiveDataType.Bool:
-                    value = signal.DataValue.Bool
-                elif signal.DataValue.Type == EPrimitiveDataType.Int8:
-                    value = signal.DataValue.Int8
-                elif signal.DataValue.Type == EPrimitiveDataType.Int16:
-                    value = signal.DataValue.Int16
-                elif signal.DataValue.Type == EPrimitiveDataType.Int32:
-                    value = signal.DataValue.Int32
-                elif signal.DataValue.Type == EPrimitiveDataType.Int64:
-                    value = signal.DataValue.Int64
-                elif signal.DataValue.Type == EPrimitiveDataType.UInt8:
-                    value = signal.DataValue.UInt8
-                elif signal.DataValue.Type == EPrimitiveDataType.UInt16:
-                    value = signal.DataValue.UInt16
-                elif signal.DataValue.Type == EPrimitiveDataType.UInt32:
-                    value = signal.DataValue.UInt32
-                elif signal.DataValue.Type == EPrimitiveDataType.UInt64:
-                    value = signal.DataValue.UInt64
-                elif signal.DataValue.Type == EPrimitiveDataType.Float:
-                    value = signal.DataValue.Float
-                elif signal.DataValue.Type == EPrimitiveDataType.Double:
-                    value = signal.DataValue.Double
-                elif signal.DataValue.Type == EPrimitiveDataType.Char:
-                    value = signal.DataValue.Char
-                res.append((var_id, value, VariableQuality.GOOD))  
+            if variables != self._read_ids:
+                idxs = [self._idx[var_id] for var_id in variables]
+                self._read_signals = [self._read_sdvbn[i] for i in idxs]
+                self._read_getters = [self._getters[i] for i in idxs]
+                self._read_ids = [sys.intern(var_id) for var_id in variables]
+                self.waitPendingRead()
+            if self.pipelineReads:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+                future = self._read_future
+                self._read_future = None
+                if future is None:
+                    signals = self._connection.ReadSignals(self._read_signals)
+                else:
+                    signals = future.result()
+                self._read_future = self._executor.submit(self._connection.ReadSignals, self._read_signals)
+            else:
+                signals = self._connection.ReadSignals(self._read_signals)
+            # Signals are returned in the same order, so the cached ids are used instead of converting each signal.Name
+            for i, (var_id, signal, getter) in enumerate(zip(self._read_ids, signals, self._read_getters)):
+                if getter is not None:
+                    res[i] = (var_id, getter(signal.DataValue), GOOD)
+                else:
+                    res[i] = (var_id, None, BAD)
         except Exception as e:
-            if "NotUpToDate" in e.Message:
+            if isNotUpToDate(e):
                 self.changeStatus(DriverStatus.ERROR)
-            res = []
-            for var_id in variables:
-                res.append((var_id, None, VariableQuality.BAD))
+            res = [(var_id, None, BAD) for var_id in variables]
         return res
 
     def writeVariables(self, variables: list) -> list:
@@ -156,48 +236,34 @@ class plcsim_advanced(driver):
         : param variables: List of tupples with variable ids and the values to be written (var_id, var_value). 
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
-        res = []
+        GOOD = VariableQuality.GOOD
+        BAD = VariableQuality.BAD
+        idx = self._idx
+        sdvs = self._sdv
+        setters = self._setters
+        sdvbns = self._sdvbn
+        res = [None]*len(variables)
         signals = []
-        for (var_id, value) in variables:
+        for i, (var_id, value) in enumerate(variables):
             try:
-                sdatavalue = SDataValue()
-                sdatavalue.Type = self.variables[var_id]['PrimitiveDataType']
-                if sdatavalue.Type == EPrimitiveDataType.Bool:
-                    sdatavalue.Bool = bool(value)
-                elif sdatavalue.Type == EPrimitiveDataType.Int8:
-                    sdatavalue.Int8 = value
-                elif sdatavalue.Type == EPrimitiveDataType.Int16:
-                    sdatavalue.Int16 = value
-                elif sdatavalue.Type == EPrimitiveDataType.Int32:
-                    sdatavalue.Int32 = value
-                elif sdatavalue.Type == EPrimitiveDataType.Int64:
-                    sdatavalue.Int64 = value
-                elif sdatavalue.Type == EPrimitiveDataType.UInt8:
-                    sdatavalue.UInt8 = value    
-                elif sdatavalue.Type == EPrimitiveDataType.UInt16:
-                    sdatavalue.UInt16 = value
-                elif sdatavalue.Type == EPrimitiveDataType.UInt32:
-                    sdatavalue.UInt32 = value
-                elif sdatavalue.Type == EPrimitiveDataType.UInt64:
-                    sdatavalue.UInt64 = value
-                elif sdatavalue.Type == EPrimitiveDataType.Float:
-                    sdatavalue.Float = value  
-                elif sdatavalue.Type == EPrimitiveDataType.Double:
-                    sdatavalue.Double = value    
-                elif sdatavalue.Type== EPrimitiveDataType.Char:
-                    sdatavalue.Char = value
-                self.variables[var_id]['SDataValueByName'].DataValue = sdatavalue
-                signals.append(self.variables[var_id]['SDataValueByName'])     
+                index = idx[var_id]
+                sdatavalue = sdvs[index]
+                setters[index](sdatavalue, value)
+                sdvbn = sdvbns[index]
+                sdvbn.DataValue = sdatavalue
+                signals.append(sdvbn)
             except Exception as e:
-                res.append((var_id, None, VariableQuality.BAD))
+                res[i] = (var_id, None, BAD)
             else:
-                res.append((var_id, value, VariableQuality.GOOD))  
+                res[i] = (var_id, value, GOOD)
         try:
-            self._connection.WriteSignals(signals)
+            if self._executor is not None:
+                # Queued after the pipelined read, the connection is only used by the worker thread
+                self._executor.submit(self._connection.WriteSignals, signals).result()
+            else:
+                self._connection.WriteSignals(signals)
         except Exception as e:
-            if "NotUpToDate" in e.Message:
+            if isNotUpToDate(e):
                 self.changeStatus(DriverStatus.ERROR)
-            res = []
-            for var_id in variables:
-                res.append((var_id, None, VariableQuality.BAD))
+            res = [(var_id, None, BAD) for (var_id, value) in variables]
         return res
@@ -16,7 +16,9 @@
 
 import sys
 import os
+import time
 import multiprocessing
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from robolink import Robolink, ITEM_TYPE_ROBOT
@@ -39,6 +41,9 @@ class robodk_api(driver):
     
     port: int
         Port looking for the RoboDK API connection (Tools-Options-Other-RoboDK API). Default = None
+
+    param_ttl: float
+        Time in seconds a read Station Parameter is reused before asking RoboDK again. Default = 0.05
     '''
 
     def __init__(self, name: str, pipe: multiprocessing.Pipe = None, params:dict = None):
@@ -53,6 +58,12 @@ class robodk_api(driver):
         self.controller = ''
         self.ip = 'localhost'
         self.port = None
+        self.param_ttl = 0.05
+
+        # Station Parameter cache {var_id: (timestamp, value)}
+        self._param_cache = {}
+        # Buffer reused to round the joint values
+        self._axis = np.zeros(6, dtype=np.float64)
 
 
     def connect(self) -> bool:
@@ -62,6 +73,7 @@ class robodk_api(driver):
         """
         try:
             #assert ROBODK_API_FOUND, "RoboDK API is not available."
+            self._param_cache.clear()
             self._connection = Robolink(robodk_ip=self.ip, port=self.port)
             if self._connection:
                 self.robot = self._connection.Item(name=self.controller, itemtype=ITEM_TYPE_ROBOT)
@@ -96,6 +108,7 @@ class robodk_api(driver):
         """
         for var_id, var_data in variables.items():
             try:
+                var_id = sys.intern(var_id)
                 if var_id == 'Axis':
                     var_data['value'] = [None for i in range(var_data['size'])]
                     self.variables[var_id] = var_data
@@ -107,6 +120,7 @@ class robodk_api(driver):
                             var_data['value'] = None # Force first update
                         else:
                             var_data['value'] = value
+                        var_data['converter'] = self.getStringConverter(var_data['datatype'])
                         self.variables[var_id] = var_data
                         self.sendDebugVarInfo((f'SETUP: Variable found {var_id}', var_id))
                         continue
@@ -116,6 +130,53 @@ class robodk_api(driver):
             self.sendDebugVarInfo((f'SETUP: Variable not found {var_id}', var_id))
 
 
+    def getParam(self, var_id: str) -> str:
+        """ Get a Station Parameter, reusing the last value if it is younger than param_ttl.
+
+        : param var_id: Station Parameter name.
+
+        : returns: Parameter value as returned by RoboDK
+        """
+        now = time.monotonic()
+        cached = self._param_cache.get(var_id)
+        if cached is not None and now - cached[0] < self.param_ttl:
+            return cached[1]
+        value = self._connection.getParam(var_id)
+        self._param_cache[var_id] = (now, value)
+        return value
+
+
+    def getParams(self, var_ids: list) -> dict:
+        """ Get several Station Parameters. Values older than param_ttl are refreshed with a single request to RoboDK
+        when more than one is needed.
+
+        : param var_ids: List of Station Parameter names.
+
+        : returns: dict with the parameter values, None if the parameter is unknown
+        """
+        now = time.monotonic()
+        res = {}
+        missing = []
+        for var_id in var_ids:
+            cached = self._param_cache.get(var_id)
+            if cached is not None and now - cached[0] < self.param_ttl:
+                res[var_id] = cached[1]
+            else:
+                missing.append(var_id)
+        if len(missing) > 1:
+            params = dict(self._connection.getParams())
+            for var_id in missing:
+                if var_id in params:
+                    value = params[var_id]
+                    self._param_cache[var_id] = (now, value)
+                    res[var_id] = value
+                else:
+                    res[var_id] = self.getParam(var_id) # Not a station parameter
+        elif missing:
+            res[missing[0]] = self.getParam(missing[0])
+        return res
+
+
     def readVariables(self, variables: list) -> list:
         """ Read given variable values. In case that the read is not possible or generates an error BAD quality should be returned.
         : param variables: List of variable ids to be read. 
@@ -123,17 +184,26 @@ class robodk_api(driver):
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
         res = []
+        try:
+            params = self.getParams([var_id for var_id in variables if var_id != 'Axis'])
+        except:
+            params = {}
         for var_id in variables:
             try:
                 if var_id == 'Axis':
                     new_value = self.robot.Joints().tr().rows[0] # robot joint rotations [Rax_1, Rax_2, Rax_3, Rax_4, Rax_5, Rax_6]
-                    new_value = [round(x,3) for x in new_value]
+                    if len(new_value) != len(self._axis):
+                        self._axis = np.zeros(len(new_value), dtype=np.float64)
+                    axis = self._axis
+                    axis[:] = new_value
+                    np.round(axis, 3, out=axis)
+                    new_value = axis.tolist() # New list every time, so the base driver can detect changes
                     res.append((var_id, new_value, VariableQuality.GOOD))
                     continue
                 else:
-                    new_value = self._connection.getParam(var_id)
+                    new_value = params[var_id]
                     if new_value is not None:
-                        new_value = self.getValueFromString(self.variables[var_id]['datatype'], new_value)
+                        new_value = self.variables[var_id]['converter'](new_value)
                         res.append((var_id, new_value, VariableQuality.GOOD))
                         continue
             except:
@@ -148,12 +218,13 @@ class robodk_api(driver):
 
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
-        res = []
-        for (var_id, new_value) in variables:
+        res = [None]*len(variables)
+        for i, (var_id, new_value) in enumerate(variables):
             try:
+                self._param_cache.pop(var_id, None)
                 self._connection.setParam(var_id, new_value)
-                res.append((var_id, new_value, VariableQuality.GOOD))
+                res[i] = (var_id, new_value, VariableQuality.GOOD)
             except:
-                res.append((var_id, new_value, VariableQuality.BAD))
+                res[i] = (var_id, new_value, VariableQuality.BAD)
                      
         return res
@@ -17,36 +17,68 @@
 import multiprocessing
 import sys
 import os
+import json
 import winreg
 
 from ..driver import driver, VariableQuality, VariableOperation
 
 # Import SDK
 ABB_SDK_FOUND = False
+# File where the RobotStudio path found in the registry is saved, to avoid scanning it on every import
+ROBOTWARE_SDK_CACHE = os.path.join(os.environ.get('LOCALAPPDATA', os.path.expanduser('~')), 'simumatik', 'robotware_sdk.json')
+# File where the controllers connected to are saved {system_name: {'system_id': str}}, to find them directly in the scanned ones
+ROBOTWARE_CONTROLLER_CACHE = os.path.join(os.path.dirname(ROBOTWARE_SDK_CACHE), 'robotware_controllers.json')
+
+def findRobotStudioPath() -> str:
+    """ Scans the registry looking for the RobotStudio installation.
+
+    : returns: Path to the RobotStudio Bin folder
+    """
+    reg = winreg.ConnectRegistry(None, winreg.HKEY_LOCAL_MACHINE)
+    main_key = winreg.OpenKey(reg, r"SOFTWARE\WOW6432Node\ABB\Robotics IT\Applications")
+    
+    i = 0
+    while True:
+        result = winreg.EnumKey(main_key, i) # Raises OSError when there are no more keys
+        i += 1
+
+        if "RobotStudio" in result:
+            key = winreg.OpenKey(main_key, result)
+            return winreg.QueryValueEx(key, "InstallDir")[0] + "Bin"
+
+def loadRobotStudioSDK(robotstudio_path:str):
+    """ Adds the ABB SDK assembly from the given RobotStudio path. Raises an exception if not possible.
+    """
+    sys.path.append(robotstudio_path) # Add path to system path
+    import clr
+    clr.FindAssembly("ABB.Robotics.Controllers.PC")
+    clr.AddReference("ABB.Robotics.Controllers.PC")
 
 try:
     if os.name == 'nt':# Just try on windows
-        reg = winreg.ConnectRegistry(None, winreg.HKEY_LOCAL_MACHINE)
-        main_key = winreg.OpenKey(reg, r"SOFTWARE\WOW6432Node\ABB\Robotics IT\Applications")
-        
-        i = 0
-        while True:
-            result = winreg.EnumKey(main_key, i)
-            i += 1
-
-            if "RobotStudio" in result:
-                key = winreg.OpenKey(main_key, result)
-                robotstudio_path = winreg.QueryValueEx(key, "InstallDir")[0] + "Bin"
-                sys.path.append(robotstudio_path) # Add path to system path
-
-                import clr
-                clr.FindAssembly("ABB.Robotics.Controllers.PC")
-                clr.AddReference("ABB.Robotics.Controllers.PC")
-                from ABB.Robotics.Controllers.Discovery import NetworkScanner
-                from ABB.Robotics.Controllers import ControllerFactory, UserInfo, IOSystemDomain
-
-                ABB_SDK_FOUND = True
-                break
+        try:
+            with open(ROBOTWARE_SDK_CACHE, 'r') as f:
+                loadRobotStudioSDK(json.load(f)['robotstudio_path'])
+        except Exception:
+            # Cache not found or not valid anymore, scan the registry
+            try:
+                os.remove(ROBOTWARE_SDK_CACHE)
+            except OSError:
+                pass
+            robotstudio_path = findRobotStudioPath()
+            loadRobotStudioSDK(robotstudio_path)
+            try:
+                os.makedirs(os.path.dirname(ROBOTWARE_SDK_CACHE), exist_ok=True)
+                with open(ROBOTWARE_SDK_CACHE, 'w') as f:
+                    json.dump({'robotstudio_path': robotstudio_path}, f)
+            except OSError:
+                pass
+
+        from ABB.Robotics.Controllers.Discovery import NetworkScanner
+        from ABB.Robotics.Controllers import ControllerFactory, UserInfo, IOSystemDomain
+        from System import Guid
+
+        ABB_SDK_FOUND = True
 except:
     pass
 
@@ -58,6 +90,15 @@ SIGNAL_GROUPINPUT = 4
 SIGNAL_GROUPOUTPUT = 5
 SIGNAL_UNKNOWN = 6
 
+# Signal types grouped by how they are read and written
+SIGNAL_DIGITAL_TYPES = frozenset([SIGNAL_DIGITALINPUT, SIGNAL_DIGITALOUTPUT]) # Older RobotStudio
+SIGNAL_ANALOG_TYPES = frozenset([SIGNAL_ANALOGINPUT, SIGNAL_ANALOGOUTPUT])
+SIGNAL_GROUP_TYPES = frozenset([SIGNAL_GROUPINPUT, SIGNAL_GROUPOUTPUT])
+if ABB_SDK_FOUND: # From RobotStudio 2022
+    SIGNAL_DIGITAL_TYPES |= {IOSystemDomain.SignalType.DigitalInput, IOSystemDomain.SignalType.DigitalOutput}
+    SIGNAL_ANALOG_TYPES |= {IOSystemDomain.SignalType.AnalogInput, IOSystemDomain.SignalType.AnalogOutput}
+    SIGNAL_GROUP_TYPES |= {IOSystemDomain.SignalType.GroupInput, IOSystemDomain.SignalType.GroupOutput}
+
 # Driver that connects to robotware
 class robotware(driver):
     '''
@@ -86,6 +127,10 @@ class robotware(driver):
         # Parameters
         self.controller = ''
         self.mec_unit = ''
+        self._connection = None
+
+        # Controller signals {name: signal}, read once when variables are added
+        self._signals = None
 
     def connect(self) -> bool:
         """ Connect driver.
@@ -96,11 +141,24 @@ class robotware(driver):
             if not ABB_SDK_FOUND:
                 raise Exception('ABB RobotWare SDK not found')
 
-            # Scan network
             scanner = NetworkScanner()
             if scanner:
+                # Scan network
                 scanner.Scan()
 
+                # Try first the controller found in a previous connection
+                if self.controller != '':
+                    controller = self.find_cached_controller(scanner)
+                    if controller is not None:
+                        try:
+                            if self.connect_controller(controller):
+                                return True
+                            elif self._connection:
+                                # Mechanical unit not found
+                                return False
+                        except Exception:
+                            pass # Cached controller not valid anymore, look for it in all the controllers
+
                 # Get controllers
                 controllers = scanner.GetControllers()
 
@@ -110,24 +168,12 @@ class robotware(driver):
                         # Save name if not defined
                         if self.controller == '': self.controller = str(controller.SystemName)
                         
-                        # Create controller
-                        self._connection = ControllerFactory.CreateFrom(controller)
-                        
-                        # Logon and connect
-                        if self._connection:
-                            # Log on
-                            self._connection.Logon(UserInfo.DefaultUser)
-                            # Check if mec_unit exists
-                            if self.mec_unit != '': 
-                                for mec_unit in self._connection.MotionSystem.MechanicalUnits:
-                                    if mec_unit.ToString() == self.mec_unit:
-                                        self._unit = mec_unit
-                                        break
-                                else:
-                                    self.sendDebugInfo((f'Mec_unit not found: {self.mec_unit}'))
-                                    return False
-                            # Done
+                        if self.connect_controller(controller):
+                            self.save_cached_controller(controller)
                             return True
+                        elif self._connection:
+                            # Mechanical unit not found
+                            return False
                         else:
                             self.sendDebugInfo(f'Cannot connect to -> {self.controller}.')
                 else:
@@ -144,6 +190,65 @@ class robotware(driver):
         """
         pass
 
+    def connect_controller(self, controller) -> bool:
+        """ Creates the controller connection and logs on.
+
+        : param controller: ControllerInfo of the controller to connect to
+        : returns: True if connected and the mechanical unit was found, False if not
+        """
+        # Create controller
+        self._connection = ControllerFactory.CreateFrom(controller)
+        self._signals = None
+        
+        # Logon and connect
+        if self._connection:
+            # Log on
+            self._connection.Logon(UserInfo.DefaultUser)
+            # Check if mec_unit exists
+            if self.mec_unit != '': 
+                for mec_unit in self._connection.MotionSystem.MechanicalUnits:
+                    if mec_unit.ToString() == self.mec_unit:
+                        self._unit = mec_unit
+                        break
+                else:
+                    self.sendDebugInfo((f'Mec_unit not found: {self.mec_unit}'))
+                    return False
+            # Done
+            return True
+        return False
+
+    def find_cached_controller(self, scanner):
+        """ Looks up the controller saved in the cache by its system id, among the ones found by the last scan.
+
+        : param scanner: NetworkScanner already scanned
+        : returns: ControllerInfo or None if not cached or not found
+        """
+        try:
+            with open(ROBOTWARE_CONTROLLER_CACHE, 'r') as f:
+                cached = json.load(f)[self.controller]
+            controller = scanner.Find(Guid(cached['system_id']))
+            if controller is not None and str(controller.SystemName) == self.controller:
+                return controller
+        except Exception:
+            pass
+        return None
+
+    def save_cached_controller(self, controller):
+        """ Saves the given controller in the cache to be found directly next time.
+        """
+        try:
+            with open(ROBOTWARE_CONTROLLER_CACHE, 'r') as f:
+                cache = json.load(f)
+        except Exception:
+            cache = {}
+        try:
+            cache[str(controller.SystemName)] = {'system_id': str(controller.SystemId)}
+            os.makedirs(os.path.dirname(ROBOTWARE_CONTROLLER_CACHE), exist_ok=True)
+            with open(ROBOTWARE_CONTROLLER_CACHE, 'w') as f:
+                json.dump(cache, f)
+        except Exception:
+            pass
+
 
     def addVariables(self, variables: dict):
         """ Add variables to the driver. Correctly added variables will be added to internal dictionary 'variables'.
@@ -152,6 +257,13 @@ class robotware(driver):
         : param variables: Variables to add in a dict following the setup format. (See documentation) 
         
         """
+        # Get all signals at once instead of one request per variable
+        if self._signals is None:
+            try:
+                self._signals = {str(signal.Name): signal for signal in self._connection.IOSystem.GetSignals(IOSystemDomain.IOFilterTypes.All)}
+            except:
+                self._signals = {}
+
         # Check variable elements
         for var_id, var_data in variables.items():
             try:
@@ -159,11 +271,17 @@ class robotware(driver):
                     var_data['value'] = [None for i in range(var_data['size'])]
                     self.variables[var_id] = var_data
                 else:
-                    signal = self._connection.IOSystem.GetSignal(var_id)
+                    signal = self._signals.get(var_id, None)
+                    if signal is None:
+                        signal = self._connection.IOSystem.GetSignal(var_id)
                     if signal:
-                        value = self.get_signal_value(signal, var_data['datatype'])
+                        signal_type = signal.Type
+                        reader = self.get_signal_reader(signal, signal_type)
+                        value = reader() if reader is not None else None
                         if value is not None:
                             var_data['signal'] = signal
+                            var_data['read'] = reader
+                            var_data['write'] = self.get_signal_writer(signal, signal_type)
                             if var_data['operation'] == VariableOperation.READ:
                                 var_data['value'] = None # Force first update
                             else:
@@ -192,17 +310,20 @@ class robotware(driver):
                     pos = mecunit.GetPosition()
                     size = self.variables[var_id]['size']
                     # robot axis rotations [Rax_1, Rax_2, Rax_3, Rax_4, Rax_5, Rax_6]
-                    new_value = [pos.RobAx.Rax_1, pos.RobAx.Rax_2, pos.RobAx.Rax_3, pos.RobAx.Rax_4, pos.RobAx.Rax_5, pos.RobAx.Rax_6]
+                    rax = pos.RobAx
+                    new_value = (rax.Rax_1, rax.Rax_2, rax.Rax_3, rax.Rax_4, rax.Rax_5, rax.Rax_6)
                     # robot external axis rotations [Eax_a, Eax_b, Eax_c, Eax_d, Eax_e, Eax_f]
                     if size>6:
-                        new_value += [pos.ExtAx.Eax_a, pos.ExtAx.Eax_b, pos.ExtAx.Eax_c, pos.ExtAx.Eax_d, pos.ExtAx.Eax_e, pos.ExtAx.Eax_f]
+                        eax = pos.ExtAx
+                        new_value += (eax.Eax_a, eax.Eax_b, eax.Eax_c, eax.Eax_d, eax.Eax_e, eax.Eax_f)
                     # Round
                     new_value = [round(x,3) for x in new_value[:size]]
                     res.append((var_id, new_value, VariableQuality.GOOD))
                 else:
-                    new_value = self.get_signal_value(self.variables[var_id]['signal'], self.variables[var_id]['datatype'])
+                    var_data = self.variables[var_id]
+                    new_value = var_data['read']()
                     if new_value is not None:
-                        new_value = self.getValueFromString(self.variables[var_id]['datatype'], new_value)
+                        new_value = self.getValueFromString(var_data['datatype'], new_value)
                         res.append((var_id, new_value, VariableQuality.GOOD))
             except:
                 res.append((var_id, self.variables[var_id]['value'], VariableQuality.BAD))
@@ -219,7 +340,7 @@ class robotware(driver):
         res = []
         for (var_id, new_value) in variables:
             try:
-                self.set_signal_value(self.variables[var_id]['signal'], new_value, self.variables[var_id]['datatype'])
+                self.variables[var_id]['write'](new_value)
                 res.append((var_id, new_value, VariableQuality.GOOD))
             except:
                 res.append((var_id, new_value, VariableQuality.BAD))
@@ -228,40 +349,30 @@ class robotware(driver):
 
     # Helper methods
 
-    def get_signal_value(self, signal, datatype):
-        # Return value
+    def get_signal_reader(self, signal, signal_type=None):
+        """ Returns a function that reads the value of the signal, resolved once depending on the signal type.
+        None if the signal type is not supported.
+        """
         if signal:
-            if signal.Type in [
-                SIGNAL_DIGITALOUTPUT, SIGNAL_DIGITALINPUT, # Older RobotStudio
-                IOSystemDomain.SignalType.DigitalInput, IOSystemDomain.SignalType.DigitalOutput # From RobotStudio 2022
-                ]:
-                return bool(signal.Value)
-            elif signal.Type in [
-                SIGNAL_ANALOGINPUT, SIGNAL_ANALOGOUTPUT, 
-                IOSystemDomain.SignalType.AnalogInput, IOSystemDomain.SignalType.AnalogOutput
-                ]:
-                return signal.Value
-            elif signal.Type in [
-                SIGNAL_GROUPOUTPUT, SIGNAL_GROUPINPUT, 
-                IOSystemDomain.SignalType.GroupInput, IOSystemDomain.SignalType.GroupOutput
-                ]:
-                return signal.GroupValue
+            if signal_type is None:
+                signal_type = signal.Type
+            if signal_type in SIGNAL_DIGITAL_TYPES:
+                return lambda: bool(signal.Value)
+            elif signal_type in SIGNAL_ANALOG_TYPES:
+                return lambda: signal.Value
+            elif signal_type in SIGNAL_GROUP_TYPES:
+                return lambda: signal.GroupValue
         return None
 
-    def set_signal_value(self, signal, new_value, datatype):
-        # Return value
+    def get_signal_writer(self, signal, signal_type=None):
+        """ Returns a function that writes a new value to the signal, resolved once depending on the signal type.
+        None if the signal type is not supported.
+        """
         if signal:
-            if signal.Type in [
-                SIGNAL_DIGITALINPUT, SIGNAL_DIGITALOUTPUT, SIGNAL_ANALOGINPUT, SIGNAL_ANALOGOUTPUT, # Older RobotStudio
-                IOSystemDomain.SignalType.DigitalInput, IOSystemDomain.SignalType.DigitalOutput, # From RobotStudio 2022
-                IOSystemDomain.SignalType.AnalogInput, IOSystemDomain.SignalType.AnalogOutput
-                ]:
-                signal.Value = new_value
-                return True
-            elif signal.Type in [
-                SIGNAL_GROUPOUTPUT, SIGNAL_GROUPINPUT, 
-                IOSystemDomain.SignalType.GroupInput, IOSystemDomain.SignalType.GroupOutput
-                ]:
-                signal.WriteGroupValue(new_value)
-                return True
-        return False
+            if signal_type is None:
+                signal_type = signal.Type
+            if signal_type in SIGNAL_DIGITAL_TYPES or signal_type in SIGNAL_ANALOG_TYPES:
+                return lambda new_value: setattr(signal, 'Value', new_value)
+            elif signal_type in SIGNAL_GROUP_TYPES:
+                return signal.WriteGroupValue
+        return None
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import struct
+import functools
 from collections import namedtuple
 from ..driver import VariableQuality, VariableDatatype
 
@@ -68,6 +69,33 @@ DATA_TRANSPORT_SIZE_BSTR     = 9           # octet string, len is in bytes
 # Others
 DATA_OK     = 0xFF
 
+# Precompiled packers
+ISO_HEADER          = struct.Struct('!HH')      # CMD, TOTAL LENGTH
+PDU_HEADER          = struct.Struct('!BBHHHH')  # Command, Type, DestRef, SourceRef, ParamLength, DataLength
+PDU_AREAS_HEADER    = struct.Struct('BB')       # Function, Item count
+PDU_SETUP_PARAMS    = struct.Struct('!HHH')     # Max jobs calling, Max jobs called, PDU length
+PDU_SETUP_REPLY     = struct.Struct('!HHHH')
+PDU_ITEM_HEADER     = struct.Struct('!BBH')     # Result, Transport size, Length
+# Value packers by data type
+S7_VALUE_STRUCTS = {
+    S7_Byte:        struct.Struct('B'),
+    S7_Word:        struct.Struct('!H'),
+    S7_Int:         struct.Struct('!h'),
+    S7_DoubleWord:  struct.Struct('!I'),
+    S7_DoubleInt:   struct.Struct('!i'),
+    S7_Real:        struct.Struct('!f'),
+}
+# Write item packers by data type {datatype: (packer, transport size, length per count)}
+S7_WRITE_STRUCTS = {
+    S7_Bit:         (struct.Struct('!BBHB'), DATA_TRANSPORT_SIZE_BBIT, 1), # Length in bits
+    S7_Byte:        (struct.Struct('!BBHB'), DATA_TRANSPORT_SIZE_BBYTE, 8),
+    S7_Word:        (struct.Struct('!BBHH'), DATA_TRANSPORT_SIZE_BBYTE, 16),
+    S7_Int:         (struct.Struct('!BBHh'), DATA_TRANSPORT_SIZE_BINT, 16),
+    S7_DoubleWord:  (struct.Struct('!BBHI'), DATA_TRANSPORT_SIZE_BBYTE, 32),
+    S7_DoubleInt:   (struct.Struct('!BBHi'), DATA_TRANSPORT_SIZE_BINT, 32),
+    S7_Real:        (struct.Struct('!BBHf'), DATA_TRANSPORT_SIZE_BREAL, 4), # Length in bytes
+}
+
 # DataArea
 DataArea = namedtuple('DataArea', ['Area', 'Start', 'Count', 'Type', 'DB','Formated'])
 
@@ -89,30 +117,29 @@ PDU = namedtuple('PDU', ['Command',     # (U8) Specific for type of PDU
 def formatPDU(tpdu):
     """ Returns the CIP request packet formated."""
     if tpdu:
-        mess = struct.pack('!BBHHHH',
-                           tpdu.Command,
-                           tpdu.Type,
-                           tpdu.DestRef,
-                           tpdu.SourceRef,
-                           tpdu.ParamLength,
-                           tpdu.DataLength)
+        mess = [PDU_HEADER.pack(tpdu.Command,
+                                tpdu.Type,
+                                tpdu.DestRef,
+                                tpdu.SourceRef,
+                                tpdu.ParamLength,
+                                tpdu.DataLength)]
         # Type 2 and 3 PDUs have 12 byte header
         if tpdu.Type in [2,3]:
-            mess += b'\x00\x00'
+            mess.append(b'\x00\x00')
         # Add Parameters
         if tpdu.ParamLength:
-            mess += tpdu.Params
+            mess.append(tpdu.Params)
         # Add Data
         if tpdu.DataLength:
-            mess += tpdu.Data
-        return mess
+            mess.append(tpdu.Data)
+        return b''.join(mess)
     else:
         return None
 
 def getPDU(message):
     """ Gets a pdu from a string."""
     try:
-        spdu = struct.unpack('!BBHHHH',message[:10])
+        spdu = PDU_HEADER.unpack_from(message)
         point = 12 if int(spdu[1]) in [2,3] else 10
         params = message[point : (point+spdu[4])] if spdu[4] else ""
         data = message[(point+spdu[4]) : (point+spdu[4]+spdu[5])] if spdu[5] else ""
@@ -124,8 +151,17 @@ def getPDU(message):
 
 def PDULengthRequest(socket, PDU_id): 
     """ Send a specific PDU to request length."""
+    reply = PDUSetupCommunication(socket, PDU_id)
+    if reply:
+        return reply[0]
+
+def PDUSetupCommunication(socket, PDU_id, max_jobs=1):
+    """ Send a setup communication PDU, negotiating the PDU length and the amount of jobs that can be sent
+        before waiting for their replies.
+        Returns (PDULength, max_jobs) accepted by the PLC.
+    """
     if socket is not None:
-        PARAMS = b'\xF0\x00\x00\x01\x00\x01\x03\xC0'
+        PARAMS = b'\xF0\x00' + PDU_SETUP_PARAMS.pack(max_jobs, max_jobs, 960)
         request = PDU(Command = 0x32,
                         Type = 0x01,
                         DestRef = 0x0000,
@@ -136,15 +172,13 @@ def PDULengthRequest(socket, PDU_id):
                         Data = b'')
         reply = exchangePDU(socket, request)
         if reply:
-            param, dummy, PDULength = struct.unpack('!HIH',reply.Params)
-            return PDULength
+            param, jobs_calling, jobs_called, PDULength = PDU_SETUP_REPLY.unpack(reply.Params)
+            return PDULength, max(1, min(max_jobs, jobs_calling, jobs_called))
 
 
 def PDU_from_ReadAreas(PDU_id:int, areas:list):
-    PARAMS = struct.pack("BB", CMD_READ, len(areas))
-    for (_, area) in areas:
-        PARAMS += area.Formated
-        
+    PARAMS = PDU_AREAS_HEADER.pack(CMD_READ, len(areas)) + b''.join([area.Formated for (_, area) in areas])
+
     return PDU(
         Command = 0x32,
         Type = 0x01,
@@ -159,10 +193,11 @@ def ReadAreas_from_PDU(pdu:PDU, areas:list):
     results = []
     if pdu:
         if pdu.Data:
+            data = pdu.Data
             point = 0
             for (name, area) in areas:
                 # Result data is OK
-                res, typelength, length = struct.unpack('!BBH',pdu.Data[point:point+4])
+                res, typelength, length = PDU_ITEM_HEADER.unpack_from(data, point)
                 if res == DATA_OK:
                     if typelength in [4,5]: # Length in Bits
                         length >>= 3
@@ -172,19 +207,9 @@ def ReadAreas_from_PDU(pdu:PDU, areas:list):
                     dataend = point+4+length
                     # Return Data
                     if area.Type == S7_Bit:
-                        value = (0,) if (pdu.Data[point+4:dataend] == b'\x00') else (1,)
-                    if area.Type == S7_Byte:
-                        value = struct.unpack('B',pdu.Data[point+4:dataend])
-                    elif area.Type == S7_Word:
-                        value = struct.unpack('!H',pdu.Data[point+4:dataend])
-                    elif area.Type == S7_Int:
-                        value = struct.unpack('!h',pdu.Data[point+4:dataend])
-                    elif area.Type == S7_DoubleWord:
-                        value = struct.unpack('!I',pdu.Data[point+4:dataend])
-                    elif area.Type == S7_DoubleInt:
-                        value = struct.unpack('!i',pdu.Data[point+4:dataend])
-                    elif area.Type == S7_Real:
-                        value = struct.unpack('!f',pdu.Data[point+4:dataend])
+                        value = (0,) if (data[point+4:dataend] == b'\x00') else (1,)
+                    else:
+                        value = S7_VALUE_STRUCTS[area.Type].unpack(data[point+4:dataend])
                     results.append((name, value[0], VariableQuality.GOOD))
                     # Value has an extra bit if not even length
                     point = dataend+dataend%2
@@ -194,31 +219,18 @@ def ReadAreas_from_PDU(pdu:PDU, areas:list):
     return results
 
 def PDU_from_WriteAreas(PDU_id:int, areadata:list):
-    PARAMS = struct.pack("BB", CMD_WRITE, len(areadata))
-    DATA = b''
+    PARAMS = [PDU_AREAS_HEADER.pack(CMD_WRITE, len(areadata))]
+    DATA = []
     for (name, area, value) in areadata:
-        PARAMS += area.Formated
+        PARAMS.append(area.Formated)
         # Attach data
-        if area.Type == S7_Bit:
-            DATA += struct.pack('!BBHB', 0, DATA_TRANSPORT_SIZE_BBIT, area.Count, value) #Different code for Bits (3)
-            # Adds an empty byte if data length is odd
-            if area.Count%2:
-                DATA += b'\x00'
-        elif area.Type == S7_Byte:
-            DATA += struct.pack('!BBHB', 0, DATA_TRANSPORT_SIZE_BBYTE, area.Count*8, value)
-            # Adds an empty byte if data length is odd
-            if area.Count%2:
-                DATA += b'\x00'
-        elif area.Type == S7_Word:
-            DATA += struct.pack('!BBHH', 0, DATA_TRANSPORT_SIZE_BBYTE, area.Count*16, value) 
-        elif area.Type == S7_Int:
-            DATA += struct.pack('!BBHh', 0, DATA_TRANSPORT_SIZE_BINT, area.Count*16, value) 
-        elif area.Type == S7_DoubleWord:
-            DATA += struct.pack('!BBHI', 0, DATA_TRANSPORT_SIZE_BBYTE, area.Count*32, value)
-        elif area.Type == S7_DoubleInt:
-            DATA += struct.pack('!BBHi', 0, DATA_TRANSPORT_SIZE_BINT, area.Count*32, value)
-        elif area.Type == S7_Real:
-            DATA += struct.pack('!BBHf', 0, DATA_TRANSPORT_SIZE_BREAL, area.Count*4, value)
+        packer, transport_size, length = S7_WRITE_STRUCTS[area.Type]
+        DATA.append(packer.pack(0, transport_size, area.Count*length, value))
+        # Adds an empty byte if data length is odd
+        if area.Type in [S7_Bit, S7_Byte] and area.Count%2:
+            DATA.append(b'\x00')
+    PARAMS = b''.join(PARAMS)
+    DATA = b''.join(DATA)
         
     return PDU(Command = 0x32,
         Type = 0x01,
@@ -235,7 +247,7 @@ def WriteAreas_from_PDU(pdu:PDU, areas:list):
     reply_OK = False
     if pdu:
         if (pdu.Params and pdu.Data):
-            res, reply_len = struct.unpack('!BB',pdu.Params)
+            res, reply_len = PDU_AREAS_HEADER.unpack(pdu.Params)
             # All area status returned
             if len(areas) == reply_len:
                 reply_OK = True
@@ -274,6 +286,33 @@ def PDUWriteAreas(socket, PDU_id, areas=[]):
         results = WriteAreas_from_PDU(reply, areas)
     return results
 
+def PDUExchangeAreas(socket, requests, max_jobs=1, build_request=PDU_from_ReadAreas, parse_reply=ReadAreas_from_PDU):
+    """ Send several read or write data PDU requests, keeping up to max_jobs requests waiting for reply at the same time.
+        Replies are matched to their request by the PDU id.
+        requests (Array of (PDU_id, areas)): areas as used in PDUReadAreas() or PDUWriteAreas()
+    """
+    results = []
+    if socket:
+        requests = [(PDU_id, areas) for (PDU_id, areas) in requests if len(areas)]
+        pending = {}
+        next_request = 0
+        while next_request < len(requests) or pending:
+            # Send requests until the window is full
+            while next_request < len(requests) and len(pending) < max_jobs:
+                PDU_id, areas = requests[next_request]
+                next_request += 1
+                if not sendPDU(socket, build_request(PDU_id, areas)):
+                    raise Exception("S7 request not sent")
+                pending[PDU_id] = areas
+            # Wait for the next reply
+            reply = receivePDU(socket)
+            if reply is None:
+                raise Exception("S7 reply not received")
+            areas = pending.pop(reply.SourceRef, None)
+            if areas is not None:
+                results += parse_reply(reply, areas)
+    return results
+
 """
  ISO-on-TCP TELEGRAMS
 """
@@ -285,7 +324,7 @@ def ISOSend(socket, message=""):
     """
     if socket:
         # Send telegram
-        reply = struct.pack('!HH', ISO_CMD, len(message)+ISO_HEADER_LEN) + message
+        reply = ISO_HEADER.pack(ISO_CMD, len(message)+ISO_HEADER_LEN) + message
         res = socket.send(reply)
         if (res == len(reply)):
             # Telegram sent
@@ -294,6 +333,16 @@ def ISOSend(socket, message=""):
     # Message not send
     return False
     
+def ISORecvExact(socket, length):
+    """ Receive exactly length bytes from the socket, or less if the connection is closed."""
+    data = socket.recv(length)
+    while 0 < len(data) < length:
+        chunk = socket.recv(length-len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
 def ISOReceive(socket):
     """ Receive message from socket.
                        -------------------------------
@@ -303,18 +352,18 @@ def ISOReceive(socket):
     if socket:
         # Read reply
         try:
-            reply_header = socket.recv(ISO_HEADER_LEN)
+            reply_header = ISORecvExact(socket, ISO_HEADER_LEN)
         except Exception as e:
             if DEBUGG: print("Driver S7Siemens Error! Timeout, ISO response not received. "+str(e))
             return None
         # Check header length
         if len(reply_header) == ISO_HEADER_LEN:
-            mess_head, mess_len = struct.unpack('!HH',reply_header)
+            mess_head, mess_len = ISO_HEADER.unpack(reply_header)
             # Check header
             if mess_head == ISO_CMD:
                 try:
-                    reply_data = socket.recv(mess_len-ISO_HEADER_LEN)
-                except socket.error as e:
+                    reply_data = ISORecvExact(socket, mess_len-ISO_HEADER_LEN)
+                except Exception as e:
                     if DEBUGG: print("Driver S7Siemens Error! ISO response not completed. "+str(e))
                     return None
                 # Extract data
@@ -384,6 +433,25 @@ def connectPLC(socket, rack=0, slot=0):
     # Not connected
     return False
 
+def sendPDU(socket, pdu):
+    """ Send a PDU without waiting for the reply."""
+    if socket:
+        request = formatPDU(pdu)
+        if request:
+            if DEBUGG: print("PDU send:", request)
+            return ISOSend(socket, ISO_EXCHANGE + request)
+    return False
+
+def receivePDU(socket):
+    """ Receive the next PDU."""
+    if socket:
+        response = ISOReceive(socket)
+        if response:
+            reply = response[3:]
+            if DEBUGG: print("PDU read:", reply)
+            return getPDU(reply)
+    return None
+
 def exchangePDU(socket, pdu):  
     """ Send a PDU."""
     if socket:
@@ -404,8 +472,9 @@ def exchangePDU(socket, pdu):
 """ 
  OTHERS
 """
+@functools.lru_cache(maxsize=4096)
 def getAreaFromString(vaddress, vdtype):
-    """ Get an area info tupple from a string."""
+    """ Get an area info tupple from a string. Results are cached, DataArea tupples are immutable."""
     try:
         # Get area
         p = 0
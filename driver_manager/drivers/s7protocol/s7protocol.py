@@ -16,8 +16,10 @@
 
 import socket
 import multiprocessing
+import itertools
+import concurrent.futures
 
-from .iso_on_tcp import (getAreaFromString, PDULengthRequest, PDUReadAreas, PDUWriteAreas, connectPLC)
+from .iso_on_tcp import (getAreaFromString, PDUSetupCommunication, PDUExchangeAreas, PDU_from_ReadAreas, ReadAreas_from_PDU, PDU_from_WriteAreas, WriteAreas_from_PDU, connectPLC)
 from ..driver import driver, VariableOperation
 
 
@@ -38,11 +40,16 @@ class s7protocol(driver):
     
     max_items_pdo: int 
         MAx number of items send in each Read/Write PDU
+
+    max_pdu_jobs: int
+        Max number of Read/Write PDUs sent before waiting for their replies. The PLC can accept less. Default = 1 (no pipelining)
+
+    connections: int
+        Number of connections opened to the PLC, the PDUs of each read/write are split between them. Each one uses a PLC connection resource. Default = 1
     '''
 
     # CONSTANTS
     MaxPDULength    = 1920
-    PDU_COUNTER     = 0
     MAX_PDU_COUNTER = 65535
 
     def __init__(self, name: str, pipe: multiprocessing.Pipe = None, params:dict = None):
@@ -58,6 +65,13 @@ class s7protocol(driver):
         self.rack = 0
         self.slot = 2
         self.max_items_pdu = 10
+        self.max_pdu_jobs = 1
+        self._pdu_jobs = 1 # Negotiated with the PLC
+        self._pdu_iter = itertools.cycle(range(1, self.MAX_PDU_COUNTER+1)) # Keeps counting across reconnections
+        self.connections = 1
+        self._connection = None
+        self._connections = [] # All open connections, the first one is _connection
+        self._executor = None
         
 
     def connect(self) -> bool:
@@ -65,31 +79,70 @@ class s7protocol(driver):
         
         : returns: True if connection established False if not
         """
+        self.max_pdu_jobs = max(1, int(self.max_pdu_jobs))
+        self._connections = []
+        self._connection = self.connectSocket()
+        if self._connection is None:
+            return False
+        self._connections = [self._connection]
+
+        # Additional connections, the driver keeps working with the ones that could be opened
+        for _ in range(1, int(self.connections)):
+            connection = self.connectSocket()
+            if connection is None:
+                break
+            self._connections.append(connection)
+        if len(self._connections) > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self._connections))
+            self.sendDebugInfo(f"{len(self._connections)} connections opened")
+        return True
+
+
+    def connectSocket(self) -> socket.socket:
+        """ Opens a new connection to the PLC and negotiates the PDU length and jobs.
+
+        : returns: the connected socket, None if not possible
+        """
         try:
-            self._connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._connection.settimeout(2)
-            self._connection.connect((self.ip, 102))
+            connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            connection.settimeout(2)
+            connection.connect((self.ip, 102))
         except Exception as e:
             self.sendDebugInfo(f"Socket connection with {self.ip} cannot be established.")
-            return False
-
-        if connectPLC(self._connection, rack=self.rack, slot=self.slot):
-            self.PDU_COUNTER = self.PDU_COUNTER + 1 if self.PDU_COUNTER < self.MAX_PDU_COUNTER else 1
-            PDULength = PDULengthRequest(self._connection, self.PDU_COUNTER)
+            return None
+
+        if connectPLC(connection, rack=self.rack, slot=self.slot):
+            try:
+                reply = PDUSetupCommunication(connection, next(self._pdu_iter), self.max_pdu_jobs)
+            except Exception as e:
+                reply = None
+                self.sendDebugInfo(f"S7 communication setup exception: {e}")
+            if reply is None:
+                connection.close()
+                self.sendDebugInfo("S7 communication setup with PLC failed.")
+                return None
+            PDULength, jobs = reply
+            self._pdu_jobs = min(self._pdu_jobs, jobs) if self._connections else jobs
             if (self.MaxPDULength > PDULength): self.MaxPDULength = PDULength
             self.sendDebugInfo("New PDU Max length set to: "+str(self.MaxPDULength))
-            return True
+            return connection
 
+        connection.close()
         self.sendDebugInfo(f"S7 Connection with PLC cannot be established.")
-        return False
+        return None
 
 
     def disconnect(self):
         """ Disconnect driver.
         """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
         if self._connection:
             self._areas = {}
-            self._connection.close()
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
 
 
     def addVariables(self, variables: dict):
@@ -124,21 +177,11 @@ class s7protocol(driver):
         for var_id in variables:
             varray.append((var_id, self.variables[var_id]['area']))
 
-        res = []
-        if len(varray)>0:
-            
-            while len(varray):
-                if len(varray) >= self.max_items_pdu:
-                    rarray = varray[:self.max_items_pdu]
-                    del varray[:self.max_items_pdu]
-                else:
-                    rarray = varray[:]
-                    varray = []
-
-                self.PDU_COUNTER = self.PDU_COUNTER + 1 if self.PDU_COUNTER < self.MAX_PDU_COUNTER else 1
-                for (vname, vvalue, quality) in PDUReadAreas(self._connection, self.PDU_COUNTER, rarray):
-                    res.append((vname, vvalue, quality))
-        return res
+        requests = []
+        pdu_iter = self._pdu_iter
+        for i in range(0, len(varray), self.max_items_pdu):
+            requests.append((next(pdu_iter), varray[i:i+self.max_items_pdu]))
+        return self.exchangeAreas(requests, PDU_from_ReadAreas, ReadAreas_from_PDU)
 
 
     def writeVariables(self, variables: list) -> list:
@@ -152,18 +195,28 @@ class s7protocol(driver):
             if new_value != None:
                 varray.append((var_id, self.variables[var_id]['area'], new_value))
 
-        res = []
-        if len(varray)>0:
-            while len(varray):
-                if len(varray) >= self.max_items_pdu:
-                    warray = varray[:self.max_items_pdu]
-                    del varray[:self.max_items_pdu]
-                else:
-                    warray = varray[:]
-                    varray = []
-                
-                self.PDU_COUNTER = self.PDU_COUNTER + 1 if self.PDU_COUNTER < self.MAX_PDU_COUNTER else 1
-                for (vname, vvalue, quality) in PDUWriteAreas(self._connection, self.PDU_COUNTER, warray):
-                    res.append((vname, vvalue, quality))
+        requests = []
+        pdu_iter = self._pdu_iter
+        for i in range(0, len(varray), self.max_items_pdu):
+            requests.append((next(pdu_iter), varray[i:i+self.max_items_pdu]))
+
+        return self.exchangeAreas(requests, PDU_from_WriteAreas, WriteAreas_from_PDU)
+
 
+    def exchangeAreas(self, requests: list, build_request, parse_reply) -> list:
+        """ Exchanges the given PDU requests, split in consecutive groups between the open connections.
+        : param requests: List of tupples (PDU_id, areas)
+
+        : returns: list of tupples including (var_id, var_value, VariableQuality)
+        """
+        connections = self._connections
+        if self._executor is None or len(requests) < 2:
+            return PDUExchangeAreas(self._connection, requests, self._pdu_jobs, build_request, parse_reply)
+
+        size = -(-len(requests) // len(connections)) # Requests per connection, rounded up
+        futures = [self._executor.submit(PDUExchangeAreas, connection, requests[i:i+size], self._pdu_jobs, build_request, parse_reply) 
+                   for connection, i in zip(connections, range(0, len(requests), size))]
+        res = []
+        for future in futures:
+            res += future.result()
         return res    
@@ -16,11 +16,32 @@
 
 import multiprocessing
 import socket
+import selectors
 import time
 import json
+import functools
+import collections
 
 from ..driver import VariableOperation, driver, VariableQuality, DriverStatus 
 
+MSGPACK_FOUND = False
+try:
+    import msgpack
+    MSGPACK_FOUND = True
+except:
+    pass
+
+def _jsonDumps(data:dict) -> bytes:
+    return json.dumps(data).encode('utf8')
+
+def _jsonLoads(data:memoryview) -> dict:
+    return json.loads(str(data, 'utf-8'))
+
+# Functions to encode and decode telegrams depending on the format {format: (dumps, loads)}
+UDP_GENERIC_FORMATS = {'json': (_jsonDumps, _jsonLoads)}
+if MSGPACK_FOUND:
+    UDP_GENERIC_FORMATS['msgpack'] = (msgpack.packb, functools.partial(msgpack.unpackb, raw=False))
+
 class udp_generic(driver):
     """
     This driver is a generic driver to communicate using UDP.
@@ -37,6 +58,9 @@ class udp_generic(driver):
 
     max_size: int
         Max telegram size (bytes). Default = 1024
+
+    format: str
+        Telegram encoding, 'json' or 'msgpack' (requires the msgpack package). Both sides must use the same. Default = 'json'
     """
 
     def __init__(self, name: str, pipe: multiprocessing.Pipe = None, params:dict = None):
@@ -52,6 +76,9 @@ class udp_generic(driver):
         self.port = 8400
         self.polling = 1
         self.max_size = 1024
+        self.format = 'json'
+        self._connection = None
+        self._selector = None
 
 
     def connect(self) -> bool:
@@ -62,21 +89,30 @@ class udp_generic(driver):
         try:   
             self.polling = int(self.polling)
             self.max_size = int(self.max_size)
+            self._addr = (self.ip, int(self.port))
+            assert self.format in UDP_GENERIC_FORMATS, f"Format {self.format} not available"
+            self._dumps, self._loads = UDP_GENERIC_FORMATS[self.format]
 
             self._connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self._connection.settimeout(self.polling*2)
+            self._polling_ns = self.polling * 1_000_000_000
+            # Receive buffer reused for every telegram
+            self._rx_buf = bytearray(self.max_size)
+            self._rx_mv = memoryview(self._rx_buf)
 
-            sec_now = int(time.perf_counter())
-            data = {"poll": sec_now}
-            self._connection.sendto(json.dumps(data).encode('utf8'), (self.ip, int(self.port)))
-            self._last_sent_poll = sec_now
+            ns_now = time.monotonic_ns()
+            data = {"poll": ns_now // 1_000_000_000}
+            self._connection.sendto(self._dumps(data), self._addr)
+            self._last_sent_poll_ns = ns_now
 
             data, address = self._connection.recvfrom(self.max_size)
-            if (data != None and address == (self.ip, int(self.port))):
-                data = json.loads(data.decode('utf-8'))
+            if (data != None and address == self._addr):
+                data = self._loads(data)
                 if data.get("poll", None) is not None:
                     self._connection.settimeout(0)
-                    self._last_recv_poll = sec_now
+                    self._selector = selectors.DefaultSelector()
+                    self._selector.register(self._connection, selectors.EVENT_READ)
+                    self._last_recv_poll_ns = ns_now
                     return True
 
         except Exception as e:
@@ -88,6 +124,9 @@ class udp_generic(driver):
     def disconnect(self):
         """ Disconnect driver.
         """
+        if self._selector:
+            self._selector.close()
+            self._selector = None
         if self._connection:
             self._connection.close()
 
@@ -101,6 +140,7 @@ class udp_generic(driver):
         """
         self.variables.update(variables)
         for _, var_data in self.variables.items():
+            var_data['converter'] = self.getStringConverter(var_data['datatype'])
             if var_data['operation'] == VariableOperation.READ:
                 var_data['value'] = None # Force first update            
             else:
@@ -113,30 +153,45 @@ class udp_generic(driver):
 
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
-        _recv_data = {}
+        # Drain all pending datagrams, decoded straight from the receive buffer as it is reused
+        decoded = []
+        recvfrom_into = self._connection.recvfrom_into
+        select = self._selector.select
+        rx_buf = self._rx_buf
+        rx_mv = self._rx_mv
+        addr = self._addr
+        loads = self._loads
         try:
-            while True:
-                _data, address = self._connection.recvfrom(self.max_size)
-                if (_data != None and address == (self.ip, int(self.port))):
-                    _data = json.loads(_data.decode('utf-8'))
-                    _recv_data.update(_data)
-        except:
-            pass
+            while select(0):
+                nbytes, address = recvfrom_into(rx_buf)
+                if address == addr:
+                    try:
+                        decoded.append(loads(rx_mv[:nbytes]))
+                    except:
+                        self.sendDebugInfo("Wrong telegram received")
+        except Exception as e:
+            self.sendDebugInfo(f"Receive failed: {e}")
+
+        # Newest telegram first, keys are only looked up for the requested variables
+        decoded.reverse()
+        _recv_data = collections.ChainMap(*decoded)
 
+        ns_now = time.monotonic_ns()
         if _recv_data.get("poll", None) != None:
-            self._last_recv_poll = int(time.perf_counter())
-            _recv_data.pop("poll")
+            self._last_recv_poll_ns = ns_now
 
 
-        if (int(time.perf_counter()) - self._last_recv_poll) > (2 * self.polling):
+        if (ns_now - self._last_recv_poll_ns) > (2 * self._polling_ns):
             self.changeStatus(DriverStatus.ERROR)
             self.sendDebugInfo("Polling msg was not received on time")
 
         res = []
         for var_id in variables:
             if var_id in _recv_data:
-                new_value = _recv_data.pop(var_id)
-                new_value = self.getValueFromString(self.variables[var_id]['datatype'], new_value)
+                try:
+                    new_value = self.variables[var_id]['converter'](_recv_data[var_id])
+                except:
+                    new_value = None
                 if new_value is not None:
                     res.append((var_id, new_value, VariableQuality.GOOD)) 
                 else:
@@ -152,26 +207,20 @@ class udp_generic(driver):
 
         : returns: list of tupples including (var_id, var_value, VariableQuality)
         """
-        _send_data = {}
+        _send_data = {var_id: new_value for (var_id, new_value) in variables}
 
-        sec_now = int(time.perf_counter())
-        if (sec_now - self._last_sent_poll) >= self.polling:
-            _send_data.update({"poll": sec_now})
-            self._last_sent_poll = sec_now   
-
-        res = []
-        for (var_id, new_value) in variables:
-            _send_data.update({var_id: new_value})
+        ns_now = time.monotonic_ns()
+        if (ns_now - self._last_sent_poll_ns) >= self._polling_ns:
+            _send_data["poll"] = ns_now // 1_000_000_000
+            self._last_sent_poll_ns = ns_now
 
+        quality = VariableQuality.GOOD
         if _send_data:
             try:
-                self._connection.sendto(json.dumps(_send_data).encode('utf8'), (self.ip, int(self.port)))
-                for (var_id, new_value) in variables:
-                    res.append((var_id, new_value, VariableQuality.GOOD))
+                self._connection.sendto(self._dumps(_send_data), self._addr)
             except:
-                for (var_id, new_value) in variables:
-                    res.append((var_id, new_value, VariableQuality.BAD))
+                quality = VariableQuality.BAD
 
-        return res
+        return [(var_id, new_value, quality) for (var_id, new_value) in variables]
 
 
@@ -23,6 +23,7 @@ from ..driver import driver, VariableQuality, VariableDatatype, VariableOperatio
 
 # Import SDK
 YASKAWA_PLCI_FOUND = False
+YASKAWA_PLCI_CONVERTERS = {} # .NET type used to write each datatype
 
 try:
     if os.name == 'nt':# Just try on windows
@@ -46,6 +47,15 @@ try:
                 import System
                 from System.Collections.Generic import List
 
+                YASKAWA_PLCI_CONVERTERS = {
+                    VariableDatatype.BOOL: System.Boolean,
+                    VariableDatatype.BYTE: System.Byte,
+                    VariableDatatype.INTEGER: System.Int32,
+                    VariableDatatype.WORD: System.UInt16,
+                    VariableDatatype.DWORD: System.UInt32,
+                    VariableDatatype.QWORD: System.UInt64,
+                    VariableDatatype.FLOAT: System.Double,
+                }
                 YASKAWA_PLCI_FOUND = True
                 break
 except:
@@ -73,6 +83,10 @@ class yaskawa_plci(driver):
         # Parameters
         self.ip = '192.168.0.1'
 
+        # Internal data
+        self._var_paths = {} # Variable path in the controller: {<var_id>: <path>}
+        self._read_ids = [] # Variables in the read list, reused while the same variables are read
+
 
     def connect(self) -> bool:
         """ Connect driver.
@@ -88,6 +102,11 @@ class yaskawa_plci(driver):
             self.sendDebugInfo(f'Connected to {self.ip}')
             self._service = self._connection.GetService[IDataAccessService]()
             assert self._service, f"IDataAccessService cannot be initialized."
+            # Lists passed to the service are reused between calls
+            self._read_list = List[System.String]()
+            self._read_ids = []
+            self._write_paths = List[System.String]()
+            self._write_values = List[System.Object]()
             return True
 
         except Exception as e:
@@ -123,6 +142,8 @@ class yaskawa_plci(driver):
                         else:
                             var_data['value'] = self.defaultVariableValue(var_data['datatype'], var_data['size'])
                         var_data['path'] = path 
+                        self._var_paths[var_id] = path
+                        var_data['converter'] = YASKAWA_PLCI_CONVERTERS.get(var_data['datatype'], None)
                         self.variables[var_id] = var_data
                         self.sendDebugVarInfo((f'SETUP: Variable found {var_id}', var_id))
                     else:
@@ -138,9 +159,12 @@ class yaskawa_plci(driver):
         """
         res = []
         try:
-            varList = List[System.String]()
-            for var_id in variables:
-                varList.Add(self.variables[var_id]['path'])
+            varList = self._read_list
+            if variables != self._read_ids:
+                varList.Clear()
+                for var_id in variables:
+                    varList.Add(self._var_paths[var_id])
+                self._read_ids = list(variables)
             if varList.Count>0:
                 new_values = self._service.ReadVariables(varList)
                 for i, new_value in enumerate(new_values):
@@ -160,26 +184,15 @@ class yaskawa_plci(driver):
         """
         res = []
         try:
-            varList = List[System.String]()
-            valueList = List[System.Object]()
+            varList = self._write_paths
+            valueList = self._write_values
+            varList.Clear()
+            valueList.Clear()
             for (var_id, new_value) in variables:
-                varList.Add(self.variables[var_id]['path'])
-                if self.variables[var_id]['datatype'] == VariableDatatype.BOOL:
-                    valueList.Add(System.Boolean(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.BYTE:
-                    valueList.Add(System.Byte(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.INTEGER:
-                    valueList.Add(System.Int32(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.WORD:
-                    valueList.Add(System.UInt16(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.DWORD:
-                    valueList.Add(System.UInt32(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.QWORD:
-                    valueList.Add(System.UInt64(new_value))
-                elif self.variables[var_id]['datatype'] == VariableDatatype.FLOAT:
-                    valueList.Add(System.Double(new_value))
-                else:
-                    assert False, "Not supported datatype!"
+                converter = self.variables[var_id]['converter']
+                assert converter is not None, "Not supported datatype!"
+                varList.Add(self._var_paths[var_id])
+                valueList.Add(converter(new_value))
             if varList.Count>0:
                 self._service.WriteVariables(varList, valueList)
                 for (var_id, new_value) in variables:
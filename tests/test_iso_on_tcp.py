@@ -0,0 +1,101 @@
+# Simumatik Gateway - Simumatik 3rd party integration tool
+# Copyright (C) 2021 Simumatik AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import struct
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from driver_manager.drivers.driver import VariableDatatype, VariableQuality
+from driver_manager.drivers.s7protocol.iso_on_tcp import (getAreaFromString, PDUExchangeAreas, PDU_from_ReadAreas, ReadAreas_from_PDU,
+                                                          PDU_from_WriteAreas, WriteAreas_from_PDU, S7_VALUE_STRUCTS, S7_Bit)
+
+class FakePLC():
+    """ Socket replacement answering S7 read and write PDUs. Pending requests are answered in reverse order,
+    so replies have to be matched by their PDU id.
+    """
+    def __init__(self, values:dict):
+        self.values = values # {start address: (datatype, value)}
+        self.pending = []
+        self.rx = b''
+        self.max_pending = 0
+
+    def send(self, data:bytes) -> int:
+        self.pending.append(data[7:]) # Skip ISO and COTP headers
+        self.max_pending = max(self.max_pending, len(self.pending))
+        return len(data)
+
+    def recv(self, length:int) -> bytes:
+        if not self.rx:
+            while self.pending:
+                self.rx += self.reply(self.pending.pop())
+        data, self.rx = self.rx[:length], self.rx[length:]
+        return data
+
+    def reply(self, pdu:bytes) -> bytes:
+        _, _, _, ref, param_len, data_len = struct.unpack('!BBHHHH', pdu[:10])
+        params, data = pdu[10:10+param_len], pdu[10+param_len:10+param_len+data_len]
+        function, count = params[0], params[1]
+        reply_data = b''
+        if function == 0x04:
+            for i in range(count):
+                start = struct.unpack('!H', params[2+i*12+10:2+i*12+12])[0]
+                datatype, value = self.values[start]
+                item = bytes([value]) if datatype == S7_Bit else S7_VALUE_STRUCTS[datatype].pack(value)
+                reply_data += struct.pack('!BBH', 0xFF, 4, len(item)*8) + item + b'\x00'*(len(item)%2)
+        else:
+            reply_data = b'\xFF'*count
+        reply_params = bytes([function, count])
+        reply = struct.pack('!BBHHHHBB', 0x32, 3, 0, ref, len(reply_params), len(reply_data), 0, 0) + reply_params + reply_data
+        reply = b'\x02\xF0\x80' + reply
+        return struct.pack('!HH', 0x0300, len(reply)+4) + reply
+
+VARIABLES = [('MB2', VariableDatatype.BYTE, 200), ('MW4', VariableDatatype.WORD, 60000), ('MW6', VariableDatatype.INTEGER, -3),
+             ('MD8', VariableDatatype.DWORD, 4000000000), ('MD12', VariableDatatype.INTEGER, -70000), ('MD16', VariableDatatype.FLOAT, 1.5),
+             ('M20.1', VariableDatatype.BOOL, 1)]
+
+class TestPDUExchangeAreas(unittest.TestCase):
+
+    def setUp(self):
+        self.areas = [(var_id, getAreaFromString(var_id, datatype), value) for var_id, datatype, value in VARIABLES]
+        self.plc = FakePLC({area.Start*(1 if area.Type == S7_Bit else 8): (area.Type, value) for _, area, value in self.areas})
+
+    def test_read_pipelined(self):
+        # One PDU per variable, up to 3 waiting for reply
+        requests = [(i+1, [(var_id, area)]) for i, (var_id, area, _) in enumerate(self.areas)]
+        res = PDUExchangeAreas(self.plc, requests, 3, PDU_from_ReadAreas, ReadAreas_from_PDU)
+        self.assertEqual(sorted(res), sorted((var_id, value, VariableQuality.GOOD) for var_id, _, value in self.areas))
+        self.assertEqual(self.plc.max_pending, 3)
+
+    def test_read_several_areas_per_pdu(self):
+        requests = [(1, [(var_id, area) for var_id, area, _ in self.areas[:4]]), (2, [(var_id, area) for var_id, area, _ in self.areas[4:]])]
+        res = PDUExchangeAreas(self.plc, requests, 1, PDU_from_ReadAreas, ReadAreas_from_PDU)
+        self.assertEqual(res, [(var_id, value, VariableQuality.GOOD) for var_id, _, value in self.areas])
+        self.assertEqual(self.plc.max_pending, 1)
+
+    def test_write_pipelined(self):
+        requests = [(i+1, [area]) for i, area in enumerate(self.areas)]
+        res = PDUExchangeAreas(self.plc, requests, 4, PDU_from_WriteAreas, WriteAreas_from_PDU)
+        self.assertEqual(sorted(res), sorted((var_id, value, VariableQuality.GOOD) for var_id, _, value in self.areas))
+
+    def test_empty_requests(self):
+        self.assertEqual(PDUExchangeAreas(self.plc, [(1, [])], 2, PDU_from_ReadAreas, ReadAreas_from_PDU), [])
+        self.assertEqual(self.plc.max_pending, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
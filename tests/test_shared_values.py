@@ -0,0 +1,124 @@
+# Simumatik Gateway - Simumatik 3rd party integration tool
+# Copyright (C) 2021 Simumatik AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import unittest
+import multiprocessing
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from driver_manager.drivers.driver import SharedValues, VariableDatatype
+
+VARIABLES = {
+    'int': {'datatype': VariableDatatype.INTEGER, 'size': 1},
+    'float': {'datatype': VariableDatatype.FLOAT, 'size': 1},
+    'bool': {'datatype': VariableDatatype.BOOL, 'size': 1},
+    'array': {'datatype': VariableDatatype.INTEGER, 'size': 3},
+    'str': {'datatype': VariableDatatype.STRING, 'size': 1},
+}
+
+def _writeArrays(name:str, lock:multiprocessing.Lock, slot:int, count:int):
+    """ Driver process side, writes [i, i, i, i] for every i up to count. """
+    table = SharedValues(name=name, lock=lock)
+    table.addVariable('array', {'datatype': VariableDatatype.INTEGER, 'size': 4}, slot)
+    for i in range(1, count+1):
+        table.write(SharedValues.FROM_DRIVER, 'array', [i]*4)
+    table.close()
+
+class TestSharedValues(unittest.TestCase):
+
+    def setUp(self):
+        # Both sides of the table, as the Driver Manager and the driver use it
+        self.manager = SharedValues(size=16)
+        self.driver = SharedValues(name=self.manager.name, lock=self.manager.lock)
+        for var_id, var_data in VARIABLES.items():
+            slot = self.manager.addVariable(var_id, var_data)
+            self.driver.addVariable(var_id, var_data, slot)
+
+    def tearDown(self):
+        self.driver.close()
+        self.manager.close(unlink=True)
+
+    def test_round_trip(self):
+        values = {'int': -5, 'float': 1.25, 'bool': True, 'array': [1, 2, 3]}
+        for var_id, value in values.items():
+            self.assertTrue(self.manager.write(SharedValues.TO_DRIVER, var_id, value))
+        res = self.driver.read(SharedValues.TO_DRIVER)
+        self.assertEqual(res, values)
+        for var_id, value in values.items():
+            self.assertIs(type(res[var_id]), type(value))
+
+    def test_regions_are_independent(self):
+        self.manager.write(SharedValues.TO_DRIVER, 'int', 1)
+        self.driver.write(SharedValues.FROM_DRIVER, 'int', 2)
+        self.assertEqual(self.manager.read(SharedValues.FROM_DRIVER), {'int': 2})
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {'int': 1})
+
+    def test_read_clears_dirty(self):
+        self.manager.write(SharedValues.TO_DRIVER, 'int', 1)
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {'int': 1})
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {})
+
+    def test_last_write_wins(self):
+        self.manager.write(SharedValues.TO_DRIVER, 'int', 1)
+        self.manager.write(SharedValues.TO_DRIVER, 'int', 2)
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {'int': 2})
+
+    def test_values_not_exact_use_the_pipe(self):
+        for var_id, value in (('int', 3.7), ('int', True), ('int', 2**60), ('bool', 2), ('float', 3),
+                              ('float', float('nan')), ('float', float('inf')), ('array', [1, 2]),
+                              ('array', [1, 2.0, 3]), ('str', 'a'), ('unknown', 1), ('int', None)):
+            self.assertFalse(self.manager.write(SharedValues.TO_DRIVER, var_id, value), (var_id, value))
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {})
+
+    def test_pipe_fallback_discards_pending_value(self):
+        self.manager.write(SharedValues.TO_DRIVER, 'int', 1)
+        self.assertFalse(self.manager.write(SharedValues.TO_DRIVER, 'int', 1.5))
+        self.assertEqual(self.driver.read(SharedValues.TO_DRIVER), {})
+
+    def test_arrays_from_another_process(self):
+        count = 20000
+        slot = self.manager.addVariable('array', {'datatype': VariableDatatype.INTEGER, 'size': 4})
+        process = multiprocessing.Process(target=_writeArrays, args=(self.manager.name, self.manager.lock, slot, count))
+        process.start()
+        last = 0
+        while True:
+            # Checked before reading, so no write is missed after the last read
+            alive = process.is_alive()
+            value = self.manager.read(SharedValues.FROM_DRIVER).get('array', None)
+            if value is not None:
+                # Never torn, never older than a previous read
+                self.assertEqual(len(set(value)), 1, value)
+                self.assertGreater(value[0], last)
+                last = value[0]
+            elif not alive:
+                break
+        process.join()
+        # The last update is never lost
+        self.assertEqual(last, count)
+
+    def test_table_full(self):
+        table = SharedValues(size=2)
+        try:
+            self.assertEqual(table.addVariable('a', VARIABLES['int']), 0)
+            self.assertIsNone(table.addVariable('b', VARIABLES['array']))
+            self.assertIsNone(table.addVariable('c', VARIABLES['str']))
+        finally:
+            table.close(unlink=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Simumatik Gateway - Simumatik 3rd party integration tool
+# Copyright (C) 2021 Simumatik AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import threading
+import unittest
+import multiprocessing.connection
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+from driver_manager.driver_manager import _ThreadPipe
+
+class TestThreadPipe(unittest.TestCase):
+
+    def setUp(self):
+        self.a, self.b = _ThreadPipe.pair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_order(self):
+        for i in range(100):
+            self.a.send(i)
+        self.assertEqual([self.b.recv() for _ in range(100)], list(range(100)))
+        self.assertFalse(self.b.poll())
+
+    def test_both_directions(self):
+        self.a.send('to b')
+        self.b.send('to a')
+        self.assertEqual(self.b.recv(), 'to b')
+        self.assertEqual(self.a.recv(), 'to a')
+        self.assertFalse(self.a.poll())
+        self.assertFalse(self.b.poll())
+
+    def test_objects_are_not_copied(self):
+        data = {'value': [1, 2]}
+        self.a.send(data)
+        self.assertIs(self.b.recv(), data)
+
+    def test_order_between_threads(self):
+        count = 2000
+        def producer():
+            for i in range(count):
+                self.a.send(i)
+        thread = threading.Thread(target=producer)
+        thread.start()
+        received = [self.b.recv() for _ in range(count)]
+        thread.join()
+        self.assertEqual(received, list(range(count)))
+
+    def test_poll_and_wait(self):
+        self.assertFalse(self.b.poll(0.01))
+        self.assertEqual(multiprocessing.connection.wait([self.b], timeout=0.01), [])
+        self.a.send(1)
+        self.assertTrue(self.b.poll())
+        self.assertEqual(multiprocessing.connection.wait([self.b], timeout=1), [self.b])
+        self.b.recv()
+        # The signal byte is consumed with the last pending object
+        self.assertEqual(multiprocessing.connection.wait([self.b], timeout=0.01), [])
+
+
+if __name__ == '__main__':
+    unittest.main()